@@ -9,6 +9,7 @@ Usage - Predict:
     results = model.predict('ultralytics_old/assets/bus.jpg')
 """
 
+import numpy as np
 from ultralytics.yolo.cfg import get_cfg
 from ultralytics.yolo.engine.exporter import Exporter
 from ultralytics.yolo.engine.model import YOLO
@@ -21,6 +22,9 @@ from .predict import FastSAMPredictor
 
 class FastSAM(YOLO):
 
+    # keep one predictor across calls so that AutoBackend setup and device selection happen only once
+    persistent_predictor = True
+
     @smart_inference_mode()
     def predict(self, source=None, stream=False, **kwargs):
         """
@@ -30,6 +34,9 @@ class FastSAM(YOLO):
             source (str | int | PIL | np.ndarray): The source of the image to make predictions on.
                           Accepts all source types accepted by the YOLO model.
             stream (bool): Whether to stream the predictions or not. Defaults to False.
+            pack_masks (bool): Return masks as box-cropped bit-packed PackedMasks. Defaults to False.
+            boxes_only (bool): Run NMS only and skip mask decoding, masks of selected instances can be decoded
+                               afterwards with decode_masks. Defaults to False.
             **kwargs : Additional keyword arguments passed to the predictor.
                        Check the 'configuration' section in the documentation for all available options.
 
@@ -39,19 +46,44 @@ class FastSAM(YOLO):
         if source is None:
             source = ROOT / 'assets' if is_git_dir() else 'https://ultralytics.com/images/bus.jpg'
             LOGGER.warning(f"WARNING ⚠️ 'source' is missing. Using 'source={source}'.")
+        pack_masks = kwargs.pop('pack_masks', False)
+        boxes_only = kwargs.pop('boxes_only', False)
         overrides = self.overrides.copy()
         overrides['conf'] = 0.25
         overrides.update(kwargs)  # prefer kwargs
         overrides['mode'] = kwargs.get('mode', 'predict')
         assert overrides['mode'] in ['track', 'predict']
         overrides['save'] = kwargs.get('save', False)  # do not save by default if called in Python
-        self.predictor = FastSAMPredictor(overrides=overrides)
-        self.predictor.setup_model(model=self.model, verbose=False)
+        if not self.predictor or not self.persistent_predictor or \
+                str(self.predictor.args.device) != str(overrides.get('device')):
+            self.predictor = FastSAMPredictor(overrides=overrides)
+            self.predictor.setup_model(model=self.model, verbose=False)
+        else:
+            # reuse the AutoBackend wrapped model, only refresh per-call args (imgsz, conf, iou ...)
+            self.predictor.args = get_cfg(self.predictor.args, overrides)
+        self.predictor.pack_masks = pack_masks
+        self.predictor.boxes_only = boxes_only
         try:
             return self.predictor(source, stream=stream)
         except Exception as e:
             return None
 
+    def warmup(self, shape=(1024, 1024), **kwargs):
+        """
+        Set up the persistent predictor and run one forward pass on a blank image.
+
+        Args:
+            shape (tuple): (height, width) of the dummy image, use the expected source size so that the
+                           letterboxed input shape matches later calls.
+            **kwargs : Predictor arguments, should be the same as the ones used for later predictions.
+        """
+        self.predict(np.zeros((*shape, 3), dtype=np.uint8), **kwargs)
+
+    @staticmethod
+    def decode_masks(result, indices=None):
+        """Decode packed masks of the selected instances of a boxes_only result, see FastSAMPredictor.decode_masks."""
+        return FastSAMPredictor.decode_masks(result, indices)
+
     def train(self, **kwargs):
         """Function trains models but raises an error as FastSAM models do not support training."""
         raise NotImplementedError("Currently, the training codes are on the way.")
@@ -2,6 +2,7 @@ import torch
 
 from ultralytics.yolo.engine.results import Results
 from ultralytics.yolo.utils import DEFAULT_CFG, ops
+from ultralytics.yolo.utils.masks import PackedMasks
 from ultralytics.yolo.v8.detect.predict import DetectionPredictor
 from .utils import bbox_iou
 
@@ -10,6 +11,10 @@ class FastSAMPredictor(DetectionPredictor):
     def __init__(self, cfg=DEFAULT_CFG, overrides=None, _callbacks=None):
         super().__init__(cfg, overrides, _callbacks)
         self.args.task = 'segment'
+        # store result masks as box-cropped bit-packed PackedMasks instead of dense (N, H, W) tensors
+        self.pack_masks = False
+        # skip prototype mask decoding, results only carry boxes (see decode_masks)
+        self.boxes_only = False
 
     def postprocess(self, preds, img, orig_imgs):
         """TODO: filter by classes."""
@@ -22,35 +27,72 @@ class FastSAMPredictor(DetectionPredictor):
                                     classes=self.args.classes)
 
         results = []
-        if len(p) == 0 or len(p[0]) == 0:
-            print("No object detected.")
-            return results
-
-        full_box = torch.zeros_like(p[0][0])
-        full_box[2], full_box[3], full_box[4], full_box[6:] = img.shape[3], img.shape[2], 1.0, 1.0
-        full_box = full_box.view(1, -1)
-        critical_iou_index = bbox_iou(full_box[0][:4], p[0][:, :4], iou_thres=0.9, image_shape=img.shape[2:])
-        if critical_iou_index.numel() != 0:
-            full_box[0][4] = p[0][critical_iou_index][:,4]
-            full_box[0][6:] = p[0][critical_iou_index][:,6:]
-            p[0][critical_iou_index] = full_box
+        # replace the box covering (almost) the whole image by the exact full box, in every image of the batch so that
+        # the result of an image does not depend on its position in the batch
+        for pred in p:
+            if not len(pred):  # images without detections still get an (empty) Results
+                continue
+            full_box = torch.zeros_like(pred[0])
+            full_box[2], full_box[3], full_box[4], full_box[6:] = img.shape[3], img.shape[2], 1.0, 1.0
+            full_box = full_box.view(1, -1)
+            critical_iou_index = bbox_iou(full_box[0][:4], pred[:, :4], iou_thres=0.9, image_shape=img.shape[2:])
+            if critical_iou_index.numel() != 0:
+                full_box[0][4] = pred[critical_iou_index][:,4]
+                full_box[0][6:] = pred[critical_iou_index][:,6:]
+                pred[critical_iou_index] = full_box
         
         proto = preds[1][-1] if len(preds[1]) == 3 else preds[1]  # second output is len 3 if pt, but only 1 if exported
         for i, pred in enumerate(p):
             orig_img = orig_imgs[i] if isinstance(orig_imgs, list) else orig_imgs
             path = self.batch[0]
             img_path = path[i] if isinstance(path, list) else path
-            if not len(pred):  # save empty boxes
-                results.append(Results(orig_img=orig_img, path=img_path, names=self.model.names, boxes=pred[:, :6]))
+            if not len(pred) or self.boxes_only:  # save empty boxes
+                if not isinstance(orig_imgs, torch.Tensor):
+                    pred[:, :4] = ops.scale_boxes(img.shape[2:], pred[:, :4], orig_img.shape)
+                result = Results(orig_img=orig_img, path=img_path, names=self.model.names, boxes=pred[:, :6])
+                # keep what is needed to decode the masks of selected instances later
+                result.mask_source = (proto[i], pred[:, 6:])
+                results.append(result)
                 continue
             if self.args.retina_masks:
                 if not isinstance(orig_imgs, torch.Tensor):
                     pred[:, :4] = ops.scale_boxes(img.shape[2:], pred[:, :4], orig_img.shape)
-                masks = ops.process_mask_native(proto[i], pred[:, 6:], pred[:, :4], orig_img.shape[:2])  # HWC
+                if self.pack_masks:
+                    # upsample each mask only inside its box, no full-size masks are materialised
+                    crops, windows = ops.process_mask_native_crops(proto[i], pred[:, 6:], pred[:, :4], orig_img.shape[:2])
+                    masks = PackedMasks.from_crops(crops, windows, orig_img.shape[:2])
+                else:
+                    masks = ops.process_mask_native(proto[i], pred[:, 6:], pred[:, :4], orig_img.shape[:2])  # HWC
             else:
                 masks = ops.process_mask(proto[i], pred[:, 6:], pred[:, :4], img.shape[2:], upsample=True)  # HWC
                 if not isinstance(orig_imgs, torch.Tensor):
                     pred[:, :4] = ops.scale_boxes(img.shape[2:], pred[:, :4], orig_img.shape)
+            if self.pack_masks and not isinstance(masks, PackedMasks):
+                masks = PackedMasks.from_dense(masks)
             results.append(
                 Results(orig_img=orig_img, path=img_path, names=self.model.names, boxes=pred[:, :6], masks=masks))
         return results
+
+    @staticmethod
+    def decode_masks(result, indices=None):
+        """
+        Decode the masks of selected instances of a boxes-only result.
+
+        Masks are upsampled inside their boxes at the original image size (same as retina_masks=True) and returned
+        packed, only the selected instances go through the mask-head matmul.
+
+        Args:
+            result (Results): A result predicted with boxes_only=True.
+            indices (array-like, optional): Instances to decode, all instances if None.
+
+        Returns:
+            (Results): The selected instances with boxes and PackedMasks.
+        """
+        proto, coeffs = result.mask_source
+        boxes = result.boxes.data
+        if indices is not None:
+            indices = torch.as_tensor(indices, dtype=torch.long, device=boxes.device)
+            boxes, coeffs = boxes[indices], coeffs[indices]
+        crops, windows = ops.process_mask_native_crops(proto, coeffs, boxes[:, :4], result.orig_shape)
+        masks = PackedMasks.from_crops(crops, windows, result.orig_shape)
+        return Results(orig_img=result.orig_img, path=result.path, names=result.names, boxes=boxes, masks=masks)
@@ -0,0 +1,141 @@
+import threading
+
+import cv2
+import numpy as np
+import torch
+from ultralytics.yolo.utils.masks import PackedMasks
+
+_buffers = threading.local()
+
+
+def _label_buffer(shape):
+    """Per-thread label map reused across frames of the same size."""
+    buf = getattr(_buffers, 'label', None)
+    if buf is None or buf.shape != shape:
+        buf = np.empty(shape, dtype=np.int32)
+        _buffers.label = buf
+    return buf
+
+
+def _mask_box(mask, pad=0):
+    """Bounding box (x1, y1, x2, y2) of a binary mask, padded and clipped to the mask, None if empty."""
+    x, y, w, h = cv2.boundingRect(mask)
+    if w == 0 or h == 0:
+        return None
+    return (max(x - pad, 0), max(y - pad, 0), min(x + w + pad, mask.shape[1]), min(y + h + pad, mask.shape[0]))
+
+
+def to_numpy_masks(annotations, height, width):
+    """
+    Convert annotations (list of dicts / arrays, a (N, H, W) tensor or PackedMasks) to a list of uint8 masks of size (height, width).
+    """
+    if isinstance(annotations, PackedMasks):
+        annotations = list(annotations)
+    if len(annotations) and isinstance(annotations[0], dict):
+        annotations = [annotation['segmentation'] for annotation in annotations]
+    if isinstance(annotations, torch.Tensor):
+        annotations = annotations.cpu().numpy()
+    masks = []
+    for mask in annotations:
+        if isinstance(mask, torch.Tensor):
+            mask = mask.cpu().numpy()
+        # bool masks are reinterpreted without a copy
+        mask = mask.view(np.uint8) if mask.dtype == bool else mask.astype(np.uint8)
+        if mask.shape[:2] != (height, width):
+            mask = cv2.resize(mask, (width, height), interpolation=cv2.INTER_NEAREST)
+        masks.append(mask)
+    return masks
+
+
+def refine_mask(mask):
+    """Morphological close (3x3) then open (8x8), computed only inside the padded mask box."""
+    box = _mask_box(mask, pad=8)
+    if box is None:
+        return mask
+    x1, y1, x2, y2 = box
+    window = cv2.morphologyEx(mask[y1:y2, x1:x2], cv2.MORPH_CLOSE, np.ones((3, 3), np.uint8))
+    window = cv2.morphologyEx(window, cv2.MORPH_OPEN, np.ones((8, 8), np.uint8))
+    mask = np.zeros_like(mask)
+    mask[y1:y2, x1:x2] = window
+    return mask
+
+
+def overlay_masks(image,
+                  masks,
+                  random_color=True,
+                  alpha=0.6,
+                  with_contours=True,
+                  contour_color=(0, 0, 255),
+                  contour_alpha=0.8,
+                  bboxes=None,
+                  points=None,
+                  point_label=None):
+    """
+    Blend instance masks over an image with a single colour-lookup pass.
+
+    Every pixel takes the colour of the smallest mask covering it (the same layering as the matplotlib renderer),
+    contours of all masks are drawn in one layer on top.
+
+    Args:
+        image (np.ndarray): (H, W, 3) uint8 image, colours are given in the same channel order.
+        masks (List[np.ndarray]): uint8 masks of size (H, W).
+        random_color (bool): Random colour per mask, otherwise a fixed blue.
+        alpha (float): Opacity of the mask colours.
+        with_contours (bool): Draw mask contours.
+        bboxes (List): Boxes [x1, y1, x2, y2] to draw.
+        points (List): Points [x, y] to draw, coloured by point_label.
+
+    Returns:
+        (np.ndarray): The rendered (H, W, 3) uint8 image.
+    """
+    height, width = image.shape[:2]
+    result = image.copy()
+    n = len(masks)
+    if n > 0:
+        if random_color:
+            colors = np.random.random((n, 3))
+        else:
+            colors = np.tile(np.array([30 / 255, 144 / 255, 255 / 255]), (n, 1))
+        # lookup table: label -1 (no mask) keeps the image, label k takes colour k
+        lut = np.concatenate([np.zeros((1, 3)), colors * 255], axis=0).astype(np.float32)
+
+        label = _label_buffer((height, width))
+        label.fill(-1)
+        boxes = [_mask_box(mask) for mask in masks]
+        # colour k belongs to the k-th smallest mask; paint large masks first so that small masks end up on top
+        order = np.argsort([cv2.countNonZero(mask) for mask in masks])
+        for k in reversed(range(n)):
+            i = order[k]
+            if boxes[i] is None:
+                continue
+            x1, y1, x2, y2 = boxes[i]
+            window = label[y1:y2, x1:x2]
+            window[masks[i][y1:y2, x1:x2] > 0] = k
+
+        covered = label >= 0
+        blended = result[covered].astype(np.float32) * (1 - alpha) + lut[label[covered] + 1] * alpha
+        result[covered] = blended.astype(np.uint8)
+
+        if with_contours:
+            contour_all = []
+            for mask, box in zip(masks, boxes):
+                if box is None:
+                    continue
+                x1, y1, x2, y2 = box
+                contours, _ = cv2.findContours(np.ascontiguousarray(mask[y1:y2, x1:x2]), cv2.RETR_TREE,
+                                               cv2.CHAIN_APPROX_SIMPLE, offset=(x1, y1))
+                contour_all.extend(contours)
+            layer = np.zeros((height, width), dtype=np.uint8)
+            cv2.drawContours(layer, contour_all, -1, 255, 2)
+            edge = layer > 0
+            result[edge] = (result[edge].astype(np.float32) * (1 - contour_alpha) +
+                            np.array(contour_color, dtype=np.float32) * contour_alpha).astype(np.uint8)
+
+    if bboxes is not None:
+        for x1, y1, x2, y2 in bboxes:
+            cv2.rectangle(result, (int(x1), int(y1)), (int(x2), int(y2)), (0, 0, 255), 1)
+    if points is not None:
+        for point, point_type in zip(points, point_label):
+            color = (191, 191, 0) if point_type == 1 else (191, 0, 191)
+            cv2.circle(result, (int(point[0]), int(point[1])), 3, color, -1)
+    return result
@@ -1,10 +1,138 @@
+import base64
 import os.path
+import queue
+import shlex
+import struct
 import threading
 import time
 import subprocess
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+import cv2
+import numpy as np
 from PIL import Image
+from src.utils.frame import Frame
 from src.utils.util import get_uni_name
 
+# screencap 原始输出中的像素格式（android PixelFormat）
+PIXEL_FORMAT_RGBA_8888 = 1
+PIXEL_FORMAT_RGBX_8888 = 2
+PIXEL_FORMAT_BGRA_8888 = 5
+
+
+def list_devices(adb_path):
+    """
+    通过 adb devices 列出当前在线的设备序列号。
+
+    :param adb_path: ADB 可执行文件的路径
+    :return: 设备序列号列表
+    """
+    result = subprocess.run(f"{adb_path} devices", capture_output=True, text=True, shell=True)
+    serials = []
+    for line in result.stdout.splitlines()[1:]:
+        fields = line.split()
+        if len(fields) >= 2 and fields[1] == "device":
+            serials.append(fields[0])
+    return serials
+
+
+class ADBShellSession:
+    """
+    常驻的 adb shell 会话，在同一个 adb 进程上顺序执行多条 shell 命令，
+    避免每条命令都重新启动 adb 进程并与 adb server 握手。
+    每条命令后追加唯一的结束标记，读到标记即认为命令完成，并从标记中解析返回码。
+    """
+
+    def __init__(self, adb_path):
+        """
+        初始化并启动常驻会话。
+
+        :param adb_path: ADB 可执行文件的路径
+        """
+        self.adb_path = adb_path
+        self.lock = threading.Lock()
+        self.process = None
+        self.lines = None
+        self.start()
+
+    def start(self):
+        """
+        启动 adb shell 进程，并开启后台线程读取其输出。
+        """
+        self.process = subprocess.Popen(f"{self.adb_path} shell", shell=True, stdin=subprocess.PIPE,
+                                        stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True,
+                                        encoding="utf-8", errors="replace", bufsize=1)
+        self.lines = queue.Queue()
+        reader = threading.Thread(target=self._read_output, args=(self.process.stdout, self.lines), daemon=True)
+        reader.start()
+
+    @staticmethod
+    def _read_output(stream, lines):
+        for line in iter(stream.readline, ''):
+            lines.put(line)
+        # 进程退出（例如设备断开）时放入结束信号
+        lines.put(None)
+
+    def is_alive(self):
+        return self.process is not None and self.process.poll() is None
+
+    def run(self, command, timeout=10):
+        """
+        在常驻会话中执行一条 shell 命令。
+
+        :param command: 在设备端执行的 shell 命令
+        :param timeout: 等待命令完成的最长时间（秒）
+        :return: subprocess.CompletedProcess，stdout 中合并了标准输出与标准错误
+        :raises Exception: 会话已断开或命令超时
+        """
+        with self.lock:
+            if not self.is_alive():
+                self.close()
+                self.start()
+
+            marker = f"__ADB_DONE_{uuid.uuid4().hex}__"
+            self.process.stdin.write(f"{{ {command} ; }} </dev/null 2>&1; echo {marker} $?\n")
+            self.process.stdin.flush()
+
+            output = []
+            deadline = time.time() + timeout
+            while True:
+                remaining = deadline - time.time()
+                try:
+                    line = self.lines.get(timeout=max(remaining, 0))
+                except queue.Empty:
+                    # 命令状态未知，丢弃整个会话，下次调用时重建
+                    self.close()
+                    raise Exception(f"Timeout executing command in adb shell session: {command}")
+                if line is None:
+                    self.close()
+                    raise Exception(f"adb shell session closed while executing command: {command}")
+
+                index = line.find(marker)
+                if index == -1:
+                    output.append(line)
+                    continue
+
+                # 命令输出末尾没有换行时，标记会与输出位于同一行
+                output.append(line[:index])
+                returncode = int(line[index + len(marker):].strip() or 1)
+                return subprocess.CompletedProcess(command, returncode, stdout="".join(output), stderr="")
+
+    def close(self):
+        """
+        关闭会话进程。
+        """
+        if self.process is None:
+            return
+        try:
+            self.process.stdin.close()
+        except Exception:
+            pass
+        if self.process.poll() is None:
+            self.process.kill()
+        self.process.wait()
+        self.process = None
+
 
 class ADBController:
     """
@@ -12,17 +140,30 @@ class ADBController:
     提供屏幕截图、滑动操作、按键事件等功能。
     """
 
-    def __init__(self, adb_path, save_dir):
+    def __init__(self, adb_path, save_dir, persistent_shell=False, type_mode="bulk", serial=None):
         """
         初始化 ADBController 类。
 
         :param adb_path: ADB 可执行文件的路径
         :param save_dir: 保存截图和录屏的目录
+        :param persistent_shell: 是否使用常驻 adb shell 会话执行命令，失败时自动回退到单次调用
+        :param type_mode: 文本输入模式，"bulk" 为批量输入，"char" 为逐字符输入
+        :param serial: 设备序列号，连接多台设备时用于指定目标设备
         """
-        self.adb_path = adb_path
+        self.serial = serial
+        self.adb_path = f"{adb_path} -s {serial}" if serial else adb_path
+        self.TIME_LIMIT = 10
+        # 最近一次输入事件（点击、滑动、按键、输入文本等）完成的时间
+        self.last_input_time = 0.0
+        self.type_mode = type_mode
+        self.shell_session = ADBShellSession(self.adb_path) if persistent_shell else None
+        # 设备的 screencap 原始输出不是 4 字节像素格式时改用 PNG 截图，只探测一次
+        self.raw_screencap = True
         self.screen_width, self.screen_height, self.screen_center = self.get_screen_size()
         self.save_dir = os.path.join(save_dir, "screenshot", get_uni_name())
         os.makedirs(self.save_dir, exist_ok=True)
+        # 截图异步落盘，不阻塞感知流程
+        self.saver = ThreadPoolExecutor(max_workers=1)
         self.init_task()
 
     def init_task(self):
@@ -36,9 +177,7 @@ class ADBController:
         :return: 屏幕宽度, 屏幕高度, 屏幕中心点 (x, y)
         :raises Exception: 如果获取屏幕尺寸失败
         """
-        self.TIME_LIMIT = 10
-        command = f"{self.adb_path} shell wm size"
-        result = self.run_commad(command)
+        result = self.run_shell("wm size")
         output = result.stdout.strip()
         size = output.split(": ")[1]
         width, height = map(int, size.split('x'))
@@ -58,8 +197,7 @@ class ADBController:
         :param end_y: 结束点 y 坐标
         :param duration: 滑动持续时间（毫秒）
         """
-        command = self.adb_path + f" shell input swipe {start_x} {start_y} {end_x} {end_y} {duration}"
-        res = self.run_commad(command)
+        res = self.run_input(f"input swipe {start_x} {start_y} {end_x} {end_y} {duration}")
         print(f"从点 ({start_x},{start_y}) 滑动到 ({end_x},{end_y})")
         print(res)
 
@@ -126,8 +264,7 @@ class ADBController:
         模拟按下电源按钮。
         """
         print("模拟按下电源按钮")
-        command = self.adb_path + f" shell input keyevent 26"
-        self.run_commad(command)
+        self.run_input("input keyevent 26")
 
     def get_screenshot(self, scale_ratio=0.5):
         """
@@ -136,25 +273,80 @@ class ADBController:
         :param scale_ratio: 缩放比例（0-1之间的值）
         :return: 保存的截图路径
         """
-        # command = self.adb_path + " shell rm /sdcard/screenshot.png"
-        # res = self.run_commad(command)
-        # print(res)
-        command = self.adb_path + " shell screencap -p /sdcard/screenshot.png"
-        self.run_commad(command)
-        command = self.adb_path + f" pull /sdcard/screenshot.png {self.save_dir}"
-        self.run_commad(command)
-
-        image_path = f"{self.save_dir}/screenshot.png"
-        save_path = f"{self.save_dir}/{get_uni_name()}.jpg"
+        frame = self.capture_frame(scale_ratio=scale_ratio, persist=True)
+        save_path = frame.wait_saved()
         print(f" 获取屏幕截图并保存到指定目录 {save_path}")
+        return save_path
+
+    def capture_frame(self, scale_ratio=1, persist=False):
+        """
+        通过 exec-out 读取 screencap 的原始 RGBA 输出，直接解析为内存中的帧，不经过设备端文件、adb pull 和图片编解码。
+        原始输出不是 4 字节像素格式（如 RGB_565）的设备改用 screencap -p 的 PNG 输出。
+
+        :param scale_ratio: 缩放比例（0-1之间的值）
+        :param persist: 是否将截图异步保存到 save_dir
+        :return: Frame 对象
+        """
+        timestamp = time.time()
+        image = self.decode_raw_screencap(self.run_exec_out("screencap")) if self.raw_screencap else None
+        if image is None:
+            self.raw_screencap = False
+            image = self.decode_png_screencap(self.run_exec_out("screencap -p"))
+        height, width = image.shape[:2]
+
+        if scale_ratio != 1:
+            new_width = int(width * scale_ratio)
+            new_height = int(height * scale_ratio)
+            image = cv2.resize(image, (new_width, new_height), interpolation=cv2.INTER_AREA)
+        frame = Frame(np.ascontiguousarray(image), timestamp=timestamp)
+
+        if persist:
+            self.save_frame(frame)
+        return frame
+
+    @staticmethod
+    def decode_raw_screencap(data):
+        """
+        :param data: screencap 的原始输出
+        :return: RGB 数组，不是 RGBA / RGBX / BGRA 8888 格式时返回 None
+        """
+        if len(data) < 12:
+            return None
+        width, height, pixel_format = struct.unpack_from("<III", data)
+        # Android 10 之后头部多了 4 字节的 colorspace 字段
+        header_size = len(data) - width * height * 4
+        if header_size not in (12, 16) or pixel_format not in (PIXEL_FORMAT_RGBA_8888, PIXEL_FORMAT_RGBX_8888,
+                                                                PIXEL_FORMAT_BGRA_8888):
+            print(f"Unsupported raw screencap output: format {pixel_format}, {len(data)} bytes for {width}x{height}, "
+                  f"fall back to screencap -p")
+            return None
+
+        pixels = np.frombuffer(data, dtype=np.uint8, offset=header_size).reshape(height, width, 4)
+        if pixel_format == PIXEL_FORMAT_BGRA_8888:
+            return pixels[..., 2::-1]
+        return pixels[..., :3]
+
+    @staticmethod
+    def decode_png_screencap(data):
+        image = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+        if image is None:
+            raise Exception(f"Failed to decode screencap -p output: {len(data)} bytes")
+        return image[..., ::-1]
+
+    def save_frame(self, frame):
+        """
+        将帧异步保存为 JPEG，保存完成后 frame.path 可用。
+
+        :param frame: Frame 对象
+        :return: 保存路径
+        """
+        save_path = f"{self.save_dir}/{frame.uid}.jpg"
+
+        def save_task():
+            Image.fromarray(frame.image).save(save_path, "JPEG")
+            frame.path = save_path
 
-        image = Image.open(image_path)
-        original_width, original_height = image.size
-        new_width = int(original_width * scale_ratio)
-        new_height = int(original_height * scale_ratio)
-        resized_image = image.resize((new_width, new_height))
-        resized_image.convert("RGB").save(save_path, "JPEG")
-        os.remove(image_path)
+        frame.save_future = self.saver.submit(save_task)
         return save_path
 
     def record_screen(self, save_name, duration=180):
@@ -165,8 +357,8 @@ class ADBController:
         :param duration: 录制持续时间（秒）
         """
         print(f" 录制屏幕并保存视频文件到 {save_name}")
-        command = self.adb_path + " shell rm /sdcard/screen_record.mp4"
-        self.run_commad(command)
+        self.run_shell("rm /sdcard/screen_record.mp4")
+        # 录屏会长时间阻塞，不占用常驻会话
         command = self.adb_path + f" shell screenrecord --time-limit {duration} /sdcard/screen_record.mp4"
         self.run_commad(command)
 
@@ -185,8 +377,7 @@ class ADBController:
         :param y: 点击的 y 坐标
         """
         print(f" 模拟在坐标 ({x},{y}) 位置的点击操作")
-        command = self.adb_path + f" shell input tap {x} {y}"
-        self.run_commad(command)
+        self.run_input(f"input tap {x} {y}")
 
     def long_press(self, x, y, duration):
         """
@@ -199,56 +390,104 @@ class ADBController:
         print(f" 模拟在坐标 ({x},{y}) 位置的长按操作")
         self.swipe(x, y, x, y, duration)
 
-    def type(self, text):
+    def type(self, text, mode=None):
         """
         在设备上输入文本。
 
         :param text: 要输入的文本
+        :param mode: 输入模式，"bulk" 将整段文本合并为一次 shell 调用，"char" 为逐字符输入的兼容模式；默认使用初始化时的 type_mode
         """
+        mode = mode or self.type_mode
         print(f"在设备上输入文本 {text}")
-        text = text.replace("\\n", "_").replace("\n", "_")
+        if mode == "char":
+            self.type_by_char(text)
+        else:
+            self.run_input(" ; ".join(self.build_type_commands(text)))
+
+    @staticmethod
+    def build_type_commands(text):
+        """
+        将文本切分为连续的 ASCII 片段、非 ASCII 片段和换行片段，每个片段只生成一条设备端命令：
+        ASCII 片段使用一次转义后的 input text，非 ASCII 片段通过 ADBKeyboard 的 ADB_INPUT_B64 广播一次性输入，
+        连续换行合并为一次 input keyevent（KEYCODE_ENTER）。"_" 等其他字符都按字面输入。
+
+        input text 会把 "%s" 替换为空格且没有转义方式，因此 "%" 单独用一条 input text 输入，不会与后面的 "s" 组成 "%s"。
+
+        :param text: 要输入的文本，字面量 "\\n" 与换行符均视为回车
+        :return: 设备端 shell 命令列表
+        """
+        text = text.replace("\\n", "\n")
+
+        def char_kind(char):
+            if char == "\n":
+                return "enter"
+            elif char == "%":
+                return "percent"
+            elif " " <= char <= "~":
+                return "ascii"
+            return "other"
+
+        runs = []
         for char in text:
-            if char == ' ':
-                command = self.adb_path + f" shell input text %s"
-                self.run_commad(command)
-            elif char == '_':
-                command = self.adb_path + f" shell input keyevent 66"
-                self.run_commad(command)
-            elif 'a' <= char <= 'z' or 'A' <= char <= 'Z' or char.isdigit():
-                command = self.adb_path + f" shell input text {char}"
-                self.run_commad(command)
-            elif char in '-.,!?@\'°/:;()':
-                command = self.adb_path + f" shell input text \"{char}\""
-                self.run_commad(command)
+            kind = char_kind(char)
+            if runs and runs[-1][0] == kind and kind != "percent":
+                runs[-1][1].append(char)
+            else:
+                runs.append((kind, [char]))
+
+        commands = []
+        for kind, chars in runs:
+            run = "".join(chars)
+            if kind == "enter":
+                commands.append("input keyevent " + " ".join(["66"] * len(run)))
+            elif kind == "percent":
+                commands.append("input text %")
+            elif kind == "ascii":
+                # input text 中 %s 表示空格
+                commands.append(f"input text {shlex.quote(run.replace(' ', '%s'))}")
             else:
-                command = self.adb_path + f" shell am broadcast -a ADB_INPUT_TEXT --es msg \"{char}\""
-                self.run_commad(command)
+                msg = base64.b64encode(run.encode("utf-8")).decode("ascii")
+                commands.append(f"am broadcast -a ADB_INPUT_B64 --es msg {msg}")
+        return commands
+
+    def type_by_char(self, text):
+        """
+        逐字符输入文本（兼容模式），每个字符一次 adb 调用，字符到命令的映射与 build_type_commands 相同。
+
+        :param text: 要输入的文本
+        """
+        for command in self.build_char_commands(text):
+            self.run_input(command)
+
+    @classmethod
+    def build_char_commands(cls, text):
+        """
+        :return: 逐字符输入时每个字符对应的设备端命令列表
+        """
+        text = text.replace("\\n", "\n")
+        return [command for char in text for command in cls.build_type_commands(char)]
 
     def back(self):
         """
         模拟按下返回按钮。
         """
         print( "模拟按下返回按钮")
-        command = self.adb_path + f" shell input keyevent 4"
-        self.run_commad(command)
+        self.run_input("input keyevent 4")
 
     def home_btn(self):
         """
         返回设备主屏幕。
         """
         print("返回设备主屏幕")
-        command = self.adb_path + f" shell am start -a android.intent.action.MAIN -c android.intent.category.HOME"
-        self.run_commad(command)
+        self.run_input("am start -a android.intent.action.MAIN -c android.intent.category.HOME")
 
     def start_activity(self, activity_name):
         print(f"启动活动 {activity_name}")
-        command = self.adb_path + f" shell am start -n {activity_name}"
-        self.run_commad(command)
+        self.run_input(f"am start -n {activity_name}")
 
     def stop_activity(self, activity_name):
         print(f"停止活动 {activity_name}")
-        command = self.adb_path + f" shell am force-stop {activity_name}"
-        self.run_commad(command)
+        self.run_input(f"am force-stop {activity_name}")
 
     def unlock_phone(self):
         if self.is_screen_off():
@@ -259,8 +498,7 @@ class ADBController:
             self.swipe(self.screen_center[0], self.screen_center[1] + 1000, self.screen_center[0], self.screen_center[1] - 200, 500)
 
     def is_screen_off(self):
-        command = self.adb_path + f" shell dumpsys power"
-        result = self.run_commad(command)
+        result = self.run_shell("dumpsys power")
 
         for line in result.stdout.splitlines():
             if "Display Power" in line:
@@ -274,8 +512,7 @@ class ADBController:
         return None
 
     def is_screen_locked(self):
-        command = self.adb_path + f" shell dumpsys window policy"
-        result = self.run_commad(command)
+        result = self.run_shell("dumpsys window policy")
         lines = result.stdout.splitlines()
         loc_flag = 0
         for i in range(len(lines)):
@@ -292,6 +529,71 @@ class ADBController:
 
         return None
     
+    def run_shell(self, command):
+        """
+        在设备上执行 shell 命令。开启常驻会话时复用会话执行，会话异常时回退到单次 adb 调用。
+
+        :param command: 在设备端执行的 shell 命令
+        :return: subprocess.CompletedProcess
+        """
+        if self.shell_session is None:
+            return self.run_commad(f"{self.adb_path} shell {shlex.quote(command)}")
+
+        start_time = time.time()
+        while True:
+            if time.time() - start_time >= self.TIME_LIMIT:
+                raise Exception(f"Exceed Maximum Time Error. Failed to executing commond: {command} ")
+            try:
+                result = self.shell_session.run(command, timeout=self.TIME_LIMIT)
+            except Exception as e:
+                print(f"常驻 adb shell 会话执行失败，回退到单次调用: {e}")
+                return self.run_commad(f"{self.adb_path} shell {shlex.quote(command)}")
+            if result.returncode == 0:
+                return result
+            else:
+                print(f"Error executing command: {result.stdout}")
+
+            time.sleep(1)
+
+    def run_input(self, command):
+        """
+        执行会改变屏幕内容的输入类命令，并记录输入事件的时间，供获取"晚于上一次输入的新帧"使用。
+
+        :param command: 在设备端执行的 shell 命令
+        :return: subprocess.CompletedProcess
+        """
+        result = self.run_shell(command)
+        self.last_input_time = time.time()
+        return result
+
+    def close(self):
+        """
+        关闭常驻 adb shell 会话。
+        """
+        if self.shell_session is not None:
+            self.shell_session.close()
+        self.saver.shutdown(wait=True)
+
+    def run_exec_out(self, command):
+        """
+        通过 adb exec-out 执行命令并返回原始二进制输出。
+
+        :param command: 在设备端执行的命令
+        :return: bytes
+        """
+        command = f"{self.adb_path} exec-out {shlex.quote(command)}"
+        start_time = time.time()
+        while True:
+            if time.time() - start_time >= self.TIME_LIMIT:
+                raise Exception(f"Exceed Maximum Time Error. Failed to executing commond: {command} ")
+            result = subprocess.run(command, capture_output=True, shell=True)
+            if result.returncode == 0 and len(result.stdout) > 0:
+                return result.stdout
+            else:
+                print(f"Error executing command: {result.stderr}")
+
+            time.sleep(1)
+
     def run_commad(self, command):
         start_time = time.time()
         while True:
@@ -1,10 +1,13 @@
-import os.path
 import time
 from src.utils.util import *
 from functools import wraps
 from .icondetector import IconDetector
 from .textdetector import OCR, find_nearest_bbox, find_bbox_by_text
 from src.core.adbcontroller import ADBController
+from src.core.framegrabber import FrameGrabber
+from src.core.inferenceserver import connect
+from src.core.perceptioncache import PerceptionCache
+from src.utils.artifacts import artifact_writer
 from tqdm import  tqdm
 
 def api(func):
@@ -23,18 +26,61 @@ def get_decorated_methods(cls, decorator):
             decorated_methods.append(name)
     return decorated_methods
 
+def collect_task_icons(task):
+    """递归收集任务中所有动作引用的图标"""
+    icons = []
+    if isinstance(task, dict):
+        if isinstance(task.get("icon"), str):
+            icons.append(task["icon"])
+        for value in task.values():
+            icons += collect_task_icons(value)
+    elif isinstance(task, list):
+        for item in task:
+            icons += collect_task_icons(item)
+    return list(dict.fromkeys(icons))
+
 class Agent():
-    def __init__(self, task_json_file, config_path):
+    def __init__(self, task_json_file, config_path, serial=None, icon_detector=None, text_detector=None, save_dir=None):
         self.tasks = load_json_file(task_json_file)
         self.configs = load_yaml_file(config_path)
+        artifact_writer.configure(**(self.configs.get("artifacts") or {}))
         self.max_op_time = self.configs["max_op_time"]
-        self.icon_detector = IconDetector(**self.configs["icon_detector"])
-        self.text_detector = OCR(**self.configs["text_detector"])
-        self.controller = ADBController(adb_path=self.configs["adb_path"], save_dir=self.configs["save_dir"])
-        self.save_dir = self.configs["save_dir"]
+        # 多设备运行时由外部传入共享的检测模型；开启推理服务时连接服务，不在本进程加载模型
+        server_configs = self.configs.get("inference_server") or {}
+        # 本 Agent 建立的推理服务连接，run 结束时关闭
+        self.inference_client = None
+        if server_configs.get("enable", False) and icon_detector is None and text_detector is None:
+            icon_detector, text_detector = connect(server_configs)
+            self.inference_client = icon_detector.client
+        # 只有本进程新建的检测模型才需要预热，共享模型与推理服务由创建方负责预热
+        warmup_icon_detector = icon_detector is None and self.configs.get("warmup", False)
+        # 本地创建的 IconDetector 与 OCR 共享同一个感知缓存
+        perception_cache = PerceptionCache(**(self.configs.get("perception_cache") or {}))
+        if icon_detector is None:
+            icon_detector = IconDetector(**self.configs["icon_detector"], perception_cache=perception_cache)
+        if text_detector is None:
+            text_detector = OCR(**self.configs["text_detector"], perception_cache=perception_cache)
+        self.icon_detector = icon_detector
+        self.text_detector = text_detector
+        self.save_dir = save_dir if save_dir is not None else self.configs["save_dir"]
+        self.controller = ADBController(adb_path=self.configs["adb_path"], save_dir=self.save_dir,
+                                        persistent_shell=self.configs.get("adb_persistent_shell", False),
+                                        type_mode=self.configs.get("adb_type_mode", "bulk"),
+                                        serial=serial)
         self.icon_sim_threshold = float(self.configs["icon_sim_threshold"])
         self.text_score_threshold = float(self.configs["text_detector"]["text_threshold"])
+        self.save_screenshots = self.configs.get("save_screenshots", False)
+        self.same_screen_tolerance = self.configs.get("same_screen_tolerance", 0)
+        grabber_configs = dict(self.configs.get("frame_grabber") or {})
+        if grabber_configs.pop("enable", False):
+            self.frame_grabber = FrameGrabber(self.controller, **grabber_configs)
+        else:
+            self.frame_grabber = None
         self.before_check_actions = []
+        if warmup_icon_detector:
+            self.icon_detector.warmup((self.controller.screen_height, self.controller.screen_width))
+        # 加载任务时预先计算任务中所有模板图标的特征
+        self.icon_detector.precompute_templates(collect_task_icons(self.tasks))
 
     def sanity_check(self, action_name):
         supported_tasks = get_decorated_methods(self, api)
@@ -42,29 +88,39 @@ class Agent():
             raise Exception("UnSupported Task Error")
 
     def run(self):
-        self.controller.init_task()
-        self.before_check_actions = [item.get("action_list") for item in self.tasks["actions"] if item.get("action") == "before_check"]
-        self.on_error_actions = [item.get("action_list") for item in self.tasks["actions"] if item.get("action") == "on_error"]
-        for action in self.tasks["actions"]:
-            if len(self.before_check_actions) > 0:
-                self.before_check(self.before_check_actions[0])
-
-            action_name = action.get("action")
-            if action_name != "before_check" or action_name != "on_error":
-                try:
-                    if self._perform_task(action):
-                        continue
-                except Exception as e:
-                    print(e)
-                    if len(self.on_error_actions) > 0:
-                        self.on_error(self.on_error_actions[0], self._perform_task, action)
-
-
-
-        print("All Task have finished")
-        icon_path = os.path.join(self.save_dir, 'tmp_icon.png')
-        if os.path.exists(icon_path):
-            os.remove(icon_path)
+        # 任务失败时同样停止截图线程、关闭 adb 会话与推理服务连接，避免在同一设备上的后续任务中累积
+        try:
+            self.controller.init_task()
+            if self.frame_grabber is not None:
+                self.frame_grabber.start()
+            self.before_check_actions = [item.get("action_list") for item in self.tasks["actions"] if item.get("action") == "before_check"]
+            self.on_error_actions = [item.get("action_list") for item in self.tasks["actions"] if item.get("action") == "on_error"]
+            for action in self.tasks["actions"]:
+                if len(self.before_check_actions) > 0:
+                    self.before_check(self.before_check_actions[0])
+
+                action_name = action.get("action")
+                if action_name != "before_check" or action_name != "on_error":
+                    try:
+                        if self._perform_task(action):
+                            continue
+                    except Exception as e:
+                        print(e)
+                        if len(self.on_error_actions) > 0:
+                            self.on_error(self.on_error_actions[0], self._perform_task, action)
+
+            print("All Task have finished")
+        finally:
+            if self.frame_grabber is not None:
+                self.frame_grabber.stop()
+            self.controller.close()
+            self.close_inference_client()
+            artifact_writer.flush()
+
+    def close_inference_client(self):
+        if self.inference_client is not None:
+            self.inference_client.close()
+            self.inference_client = None
 
 
     @api
@@ -78,18 +134,14 @@ class Agent():
     @api
     def openAppByIcon(self, icon, text = '', **kwargs):
         text = text.strip()
-        icon_path = os.path.join(self.save_dir, 'tmp_icon.png')
-        if os.path.exists(icon_path):
-            os.remove(icon_path)
-        load_image(icon).save(icon_path)
         self.controller.home_btn()
         time.sleep(0.5)
         swipe_direction = 0
         count = 0
         bbox = None
         while True:
-            img_cur = self.controller.get_screenshot(scale_ratio=1)
-            det_res = self.icon_detector.det(img_cur, icon_path)
+            img_cur = self._capture()
+            det_res = self.icon_detector.det(img_cur, icon, min_score=self.icon_sim_threshold)
             print(det_res)
             if len(det_res) > 0 and float(det_res[0][0]) >= float(self.configs["icon_sim_threshold"]):
                 bbox = det_res[0][1]
@@ -102,8 +154,8 @@ class Agent():
             direction = 'left' if swipe_direction == 0 else "right"
             self.swipe(direction, 500, 300)
             time.sleep(0.5)
-            img = self.controller.get_screenshot(scale_ratio=1)
-            if is_same_img(img, img_cur):
+            img = self._capture()
+            if is_same_img(img, img_cur, tolerance=self.same_screen_tolerance):
                 swipe_direction = 1 - swipe_direction
                 count += 1
 
@@ -117,9 +169,9 @@ class Agent():
         return True
 
     @api
-    def click_icon(self, icon, text ='', **kwargs):
-        img_cur = self.controller.get_screenshot(scale_ratio=1)
-        status,bbox,score = self._find_bbox_by_icon(img_cur, icon)
+    def click_icon(self, icon, text ='', region = None, **kwargs):
+        img_cur = self._capture()
+        status,bbox,score = self._find_bbox_by_icon(img_cur, icon, region)
         if status and self._check_nearby_text(img_cur, bbox, text):
             print("bbox: ", bbox)
             print("score: ", score)
@@ -131,9 +183,9 @@ class Agent():
         return False
 
     @api
-    def long_press_icon(self, icon, text = '', duration = 1000,  **kwargs):
-        img_cur = self.controller.get_screenshot(scale_ratio=1)
-        status, bbox, score = self._find_bbox_by_icon(img_cur, icon)
+    def long_press_icon(self, icon, text = '', duration = 1000, region = None, **kwargs):
+        img_cur = self._capture()
+        status, bbox, score = self._find_bbox_by_icon(img_cur, icon, region)
         if status and self._check_nearby_text(img_cur, bbox, text):
             print("bbox: ", bbox)
             print("score: ", score)
@@ -195,10 +247,11 @@ class Agent():
         return True
 
     @api
-    def exist_icon(self, icon, score = None, true_action = {}, false_action = {}):
+    def exist_icon(self, icon, score = None, true_action = {}, false_action = {}, region = None):
         if not score:
             score = self.icon_sim_threshold
-        status, bbox, pred_score = self._find_bbox_by_icon(icon)
+        img_cur = self._capture()
+        status, bbox, pred_score = self._find_bbox_by_icon(img_cur, icon, region)
         if status and pred_score >= score:
             print(f"Icon {icon} is exist")
             print("Perform True Action")
@@ -243,6 +296,7 @@ class Agent():
     @api
     def before_check(self, action_list):
         print("Running before tasks")
+        self._prefetch_icons(action_list)
         for action in action_list:
             self._perform_task(action)
         print("All before tasks have been finished")
@@ -265,6 +319,16 @@ class Agent():
                 self._perform_task(action)
             print(f"The NO {i} repeat_actions have been finished")
 
+    def _capture(self):
+        if self.frame_grabber is None:
+            return self.controller.capture_frame(scale_ratio=1, persist=self.save_screenshots)
+
+        # 取后台截图线程中晚于上一次输入事件的最新帧
+        frame = self.frame_grabber.wait_for_frame(newer_than=self.controller.last_input_time)
+        if self.save_screenshots and frame.save_future is None:
+            self.controller.save_frame(frame)
+        return frame
+
     def _check_nearby_text(self, img_cur, bbox, text):
         if text != '':
             text_det_res = self.text_detector.det(img_cur)
@@ -277,12 +341,24 @@ class Agent():
         else:
             return True
 
-    def _find_bbox_by_icon(self, img_cur, icon):
-        icon_path = os.path.join(self.save_dir, 'tmp_icon.png')
-        if os.path.exists(icon_path):
-            os.remove(icon_path)
-        load_image(icon).save(icon_path)
-        det_res = self.icon_detector.det(img_cur, icon_path)
+    def _prefetch_icons(self, action_list):
+        """
+        动作列表中有多个 exist_icon 时，在当前截图上一次匹配所有图标；结果进入感知缓存，画面不变时后续的 exist_icon 直接命中。
+        """
+        groups = {}
+        for action in action_list:
+            if action.get("action") == "exist_icon":
+                region = action.get("region")
+                groups.setdefault(tuple(region) if region is not None else None, []).append(action["icon"])
+        if sum(len(icons) for icons in groups.values()) < 2:
+            return
+        img_cur = self._capture()
+        for region, icons in groups.items():
+            self.icon_detector.det_many(img_cur, icons, region=list(region) if region is not None else None,
+                                        min_score=self.icon_sim_threshold)
+
+    def _find_bbox_by_icon(self, img_cur, icon, region=None):
+        det_res = self.icon_detector.det(img_cur, icon, region=region, min_score=self.icon_sim_threshold)
         if len(det_res) > 0 and float(det_res[0][0]) >= self.icon_sim_threshold :
             bbox = det_res[0][1]
             return True, bbox, float(det_res[0][0])
@@ -290,7 +366,7 @@ class Agent():
             return False, None, None
 
     def _find_bbox_by_text(self, text):
-        img_cur = self.controller.get_screenshot(scale_ratio=1)
+        img_cur = self._capture()
         text_det_res = self.text_detector.det(img_cur)
         bbox, score = find_bbox_by_text(text, *text_det_res)
         print(f"_find_bbox_by_text bbox:{bbox} score:{score}")
@@ -0,0 +1,148 @@
+import hashlib
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+import numpy as np
+from src.utils.imghash import dhash, to_gray
+
+
+class EmbeddingStore:
+    """
+    模板图标的特征缓存。
+
+    以 "模型名称_内容哈希" 为键保存模板经过 metric model 得到的特征，并持久化为 npz 文件，
+    同一模板在多次调用和多次运行之间只需前向计算一次。
+
+    多个进程可以共用同一个文件：写入时先合并文件中其他进程已保存的特征，再写到同目录下的独立临时文件并原子替换；
+    文件损坏时忽略该文件，从空缓存开始。
+    """
+
+    def __init__(self, path, model_name):
+        """
+        :param path: npz 文件路径，为 None 时只在内存中缓存
+        :param model_name: 模型标识（模型名称、权重、输入尺寸），模型变化时缓存自动失效
+        """
+        self.path = path
+        self.model_name = model_name
+        self.lock = threading.Lock()
+        # 内存中有未写入文件的特征
+        self.dirty = False
+        self.embeddings = self.load()
+        if self.embeddings:
+            print(f"Loaded {len(self.embeddings)} icon embeddings from {path}")
+
+    def load(self):
+        if self.path is None or not os.path.exists(self.path):
+            return {}
+        try:
+            with np.load(self.path) as data:
+                return {key: data[key] for key in data.files}
+        except Exception as e:
+            print(f"Failed to load icon embeddings from {self.path}, start with an empty cache: {e}")
+            return {}
+
+    def key(self, data):
+        """
+        :param data: 模板内容（文件字节或像素字节）
+        :return: 缓存键
+        """
+        return f"{self.model_name}_{hashlib.sha1(data).hexdigest()}"
+
+    def get(self, key):
+        with self.lock:
+            return self.embeddings.get(key)
+
+    def put(self, key, embedding):
+        """只写入内存，调用 save 后才持久化"""
+        with self.lock:
+            self.embeddings[key] = embedding
+            self.dirty = True
+
+    def save(self):
+        with self.lock:
+            if self.path is None or not self.dirty:
+                return
+            for key, embedding in self.load().items():
+                self.embeddings.setdefault(key, embedding)
+            directory = os.path.dirname(os.path.abspath(self.path))
+            os.makedirs(directory, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    np.savez(f, **self.embeddings)
+                os.replace(tmp_path, self.path)
+            except BaseException:
+                os.remove(tmp_path)
+                raise
+            self.dirty = False
+
+    def __len__(self):
+        return len(self.embeddings)
+
+
+class CropEmbeddingCache:
+    """
+    分割块特征的 LRU 缓存。
+
+    以分割块的感知哈希（差值哈希 + 尺寸与平均亮度的粗量化）为键，相同的界面元素在连续的截图中重复出现时
+    直接复用缓存的特征，跳过 metric model。缓存总大小受 max_bytes 限制，超出时淘汰最久未使用的条目。
+    """
+
+    def __init__(self, max_bytes=64 * 1024 * 1024, hash_size=16):
+        """
+        :param max_bytes: 缓存特征占用的最大字节数，为 0 时关闭缓存
+        :param hash_size: 差值哈希的边长
+        """
+        self.max_bytes = max_bytes
+        self.hash_size = hash_size
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, img):
+        """
+        :param img: RGB 格式的分割块数组
+        :return: 缓存键
+        """
+        gray = to_gray(img)
+        h, w = gray.shape[:2]
+        return dhash(gray, self.hash_size).tobytes(), h // 4, w // 4, int(gray.mean()) // 16
+
+    def get(self, key):
+        with self.lock:
+            embedding = self.entries.get(key)
+            if embedding is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return embedding
+
+    def put(self, key, embedding):
+        if self.max_bytes <= 0:
+            return
+        with self.lock:
+            if key in self.entries:
+                self.nbytes -= self.entries.pop(key).nbytes
+            self.entries[key] = embedding
+            self.nbytes += embedding.nbytes
+            while self.nbytes > self.max_bytes and self.entries:
+                _, evicted = self.entries.popitem(last=False)
+                self.nbytes -= evicted.nbytes
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total > 0 else 0.0,
+            "entries": len(self.entries),
+            "bytes": self.nbytes,
+        }
+
+    def reset_stats(self):
+        self.hits = 0
+        self.misses = 0
@@ -0,0 +1,169 @@
+import argparse
+import os
+import queue
+import threading
+from functools import wraps
+from src.utils.util import load_yaml_file
+from src.utils.artifacts import artifact_writer
+from .icondetector import IconDetector
+from .textdetector import OCR
+from .perceptioncache import PerceptionCache
+from .adbcontroller import list_devices
+from .agent import Agent
+
+
+class SharedDetector:
+    """
+    多个设备线程共享同一个检测器时使用的包装类，所有方法调用通过可重入锁串行执行。
+
+    for_device 为每台设备返回共享同一检测器与锁的包装：图标位置先验按设备各自保存并随 det / det_many 传入，
+    last_tier 等统计在持有锁时随结果一起取走，不会被其他设备的调用覆盖。
+    """
+
+    # 每次调用后从检测器复制到包装上的统计属性
+    STATS = ("last_tier", "last_tiers", "last_filter_stats")
+
+    def __init__(self, detector, lock=None, locations=None):
+        """
+        :param detector: 被共享的检测器
+        :param lock: 共享的锁，默认新建
+        :param locations: 该包装独立保存的图标位置先验，为 None 时使用检测器自身的先验
+        """
+        self.detector = detector
+        self.lock = threading.RLock() if lock is None else lock
+        self.locations = locations
+
+    def for_device(self):
+        return SharedDetector(self.detector, self.lock, locations={})
+
+    def __getattr__(self, name):
+        attr = getattr(self.detector, name)
+        if not callable(attr):
+            return attr
+
+        @wraps(attr)
+        def locked(*args, **kwargs):
+            if self.locations is not None and name in ("det", "det_many"):
+                kwargs.setdefault("locations", self.locations)
+            with self.lock:
+                res = attr(*args, **kwargs)
+                for stat in self.STATS:
+                    if hasattr(self.detector, stat):
+                        setattr(self, stat, getattr(self.detector, stat))
+            return res
+        return locked
+
+
+class Fleet:
+    """
+    多设备执行器：发现所有在线设备，每台设备一个工作线程和一个任务队列，并行执行 tasks/ 中的任务文件。
+    IconDetector 与 OCR 模型只加载一次，由所有设备共享，图标位置先验按设备分开保存；每台设备的结果保存在 save_dir/devices/<serial> 下。
+    """
+
+    def __init__(self, config_path, serials=None, icon_detector=None, text_detector=None):
+        """
+        :param config_path: 配置文件路径
+        :param serials: 设备序列号列表，默认使用 adb devices 发现的全部设备
+        :param icon_detector: 共享的图标检测器，默认根据配置创建
+        :param text_detector: 共享的文字检测器，默认根据配置创建
+        """
+        self.config_path = config_path
+        self.configs = load_yaml_file(config_path)
+        artifact_writer.configure(**(self.configs.get("artifacts") or {}))
+        self.serials = serials or list_devices(self.configs["adb_path"])
+        if len(self.serials) == 0:
+            raise Exception("No Device Found Error")
+        print(f"发现设备: {self.serials}")
+
+        # 开启推理服务时每个 Agent 各自连接服务，由服务端跨设备合并批量推理
+        use_server = (self.configs.get("inference_server") or {}).get("enable", False)
+        perception_cache = PerceptionCache(**(self.configs.get("perception_cache") or {}))
+        if icon_detector is None and not use_server:
+            icon_detector = SharedDetector(IconDetector(**self.configs["icon_detector"], perception_cache=perception_cache))
+            if self.configs.get("warmup", False):
+                icon_detector.warmup()
+        if text_detector is None and not use_server:
+            text_detector = SharedDetector(OCR(**self.configs["text_detector"], perception_cache=perception_cache))
+        self.icon_detector = icon_detector
+        self.text_detector = text_detector
+        # 每台设备各自的图标检测器包装，图标位置先验在同一设备的任务之间保留
+        self.device_icon_detectors = {
+            serial: icon_detector.for_device() if isinstance(icon_detector, SharedDetector) else icon_detector
+            for serial in self.serials}
+
+        self.queues = {serial: queue.Queue() for serial in self.serials}
+        self.results = {serial: [] for serial in self.serials}
+        self.workers = []
+
+    def device_save_dir(self, serial):
+        return os.path.join(self.configs["save_dir"], "devices", serial.replace(":", "_"))
+
+    def submit(self, task_json_file, serials=None):
+        """
+        将任务文件加入指定设备（默认全部设备）的任务队列。
+        """
+        for serial in serials or self.serials:
+            self.queues[serial].put(task_json_file)
+
+    def start(self):
+        for serial in self.serials:
+            worker = threading.Thread(target=self._worker, args=(serial,), daemon=True)
+            worker.start()
+            self.workers.append(worker)
+
+    def join(self):
+        """
+        等待所有已提交的任务完成并停止工作线程。
+
+        :return: {serial: [(task_json_file, status), ...]}
+        """
+        for serial in self.serials:
+            self.queues[serial].put(None)
+        for worker in self.workers:
+            worker.join()
+        self.workers.clear()
+        return self.results
+
+    def run(self, task_json_files):
+        """
+        在所有设备上并行执行给定的任务文件。
+
+        :param task_json_files: 任务文件路径列表
+        :return: {serial: [(task_json_file, status), ...]}
+        """
+        for task_json_file in task_json_files:
+            self.submit(task_json_file)
+        self.start()
+        return self.join()
+
+    def _worker(self, serial):
+        save_dir = self.device_save_dir(serial)
+        os.makedirs(save_dir, exist_ok=True)
+        while True:
+            task_json_file = self.queues[serial].get()
+            if task_json_file is None:
+                break
+
+            print(f"[{serial}] Running task {task_json_file}")
+            try:
+                agent = Agent(task_json_file, self.config_path, serial=serial, icon_detector=self.device_icon_detectors[serial],
+                              text_detector=self.text_detector, save_dir=save_dir)
+                agent.run()
+                status = True
+            except Exception as e:
+                print(f"[{serial}] Task {task_json_file} failed: {e}")
+                status = False
+            self.results[serial].append((task_json_file, status))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Run task files across all connected devices")
+    parser.add_argument("tasks", nargs="+", help="task json files")
+    parser.add_argument("--config", default="configs/config.yaml")
+    parser.add_argument("--serials", nargs="*", default=None, help="device serials, default to all devices")
+    args = parser.parse_args()
+
+    fleet = Fleet(args.config, serials=args.serials)
+    results = fleet.run(args.tasks)
+    for serial, res in results.items():
+        print(serial, res)
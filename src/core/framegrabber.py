@@ -0,0 +1,85 @@
+import threading
+import time
+from collections import deque
+
+
+class FrameGrabber:
+    """
+    后台连续截图服务。
+
+    在独立线程中不断通过 ADBController.capture_frame 截取原始屏幕帧，并在环形缓冲区中保留最近的若干帧及其时间戳。
+    Agent 的动作通过 wait_for_frame 获取"晚于上一次输入事件的最新帧"，截图与设备操作、模型推理并行进行。
+    """
+
+    def __init__(self, controller, buffer_size=8, interval=0.0, scale_ratio=1, timeout=10):
+        """
+        :param controller: ADBController 实例
+        :param buffer_size: 环形缓冲区保留的帧数
+        :param interval: 两次截图之间的间隔（秒）
+        :param scale_ratio: 截图缩放比例
+        :param timeout: 等待新帧的默认超时时间（秒）
+        """
+        self.controller = controller
+        self.frames = deque(maxlen=buffer_size)
+        self.interval = interval
+        self.scale_ratio = scale_ratio
+        self.timeout = timeout
+        self.condition = threading.Condition()
+        self.running = False
+        self.thread = None
+
+    def start(self):
+        if self.running:
+            return
+        self.running = True
+        self.thread = threading.Thread(target=self._loop, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def _loop(self):
+        while self.running:
+            try:
+                frame = self.controller.capture_frame(scale_ratio=self.scale_ratio)
+            except Exception as e:
+                print(f"后台截图失败: {e}")
+                time.sleep(0.5)
+                continue
+
+            with self.condition:
+                self.frames.append(frame)
+                self.condition.notify_all()
+
+            if self.interval > 0:
+                time.sleep(self.interval)
+
+    def latest(self):
+        """
+        返回缓冲区中最新的帧，缓冲区为空时返回 None。
+        """
+        with self.condition:
+            return self.frames[-1] if self.frames else None
+
+    def wait_for_frame(self, newer_than=0.0, timeout=None):
+        """
+        返回截图开始时间晚于 newer_than 的最新帧，必要时阻塞等待。
+
+        :param newer_than: 时间戳下限，通常为上一次输入事件的时间
+        :param timeout: 最长等待时间（秒），默认使用初始化时的 timeout
+        :return: Frame 对象
+        :raises Exception: 超时仍未获取到新帧
+        """
+        timeout = self.timeout if timeout is None else timeout
+        deadline = time.time() + timeout
+        with self.condition:
+            while True:
+                if self.frames and self.frames[-1].timestamp > newer_than:
+                    return self.frames[-1]
+                remaining = deadline - time.time()
+                if remaining <= 0 or not self.running:
+                    raise Exception("Timeout waiting for a fresh frame Error")
+                self.condition.wait(remaining)
@@ -1,122 +1,685 @@
 import os.path
+import queue
+import threading
 import time
 import cv2
 import torch
+import torch.nn.functional as F
 from src.core.segmenter import Segmenter
 from src.core.metrics import Metrics
+from src.core.embeddingstore import EmbeddingStore, CropEmbeddingCache
+from src.core.perceptioncache import PerceptionCache
+from src.core.segmentfilter import SegmentFilter
 from src.models.model import load_pretrained_model
 from PIL import Image
 import numpy as np
-from tqdm import tqdm
-from src.utils.util import draw_bbox, draw_text,get_uni_name,load_image, is_same_img
+from src.utils.artifacts import artifact_writer
+from src.utils.frame import Frame
+from src.utils.imghash import to_gray
+from src.utils.util import draw_bbox, draw_text,get_uni_name,load_image, load_image_array
 
 class IconDetector():
-    def __init__(self, device = 'cpu', segment_weight_path = "./weights", metric_weight_path = './weights', metric_model = 'vgg19', save_dir = './results', target_height = 224, target_width = 224, batch_size = 32, topK = 1):
+    def __init__(self, device = 'cpu', segment_weight_path = "./weights", metric_weight_path = './weights', metric_model = 'vgg19', save_dir = './results', target_height = 224, target_width = 224, batch_size = 32, topK = 1, embedding_cache_path = None, crop_cache_size_mb = 64, roi_prior = True, roi_padding = 2.0, segment_imgsz = 1024, template_match = True, template_threshold = 0.85, template_scales = (0.8, 1.0, 1.25), template_work_scale = 0.5, segment_workers = 0, segment_candidates = 0, prefetch_batches = 2, prefilter = True, prefilter_args = None, ranked_match = False, ranked_margin = 0.05, perception_cache = None):
         self.device = device
         self.save_dir = os.path.join(save_dir, get_uni_name())
         os.makedirs(self.save_dir, exist_ok=True)
         self.metric_model = load_pretrained_model(weight_path=metric_weight_path, modelName=metric_model, device=device)
-        self.seg_model = Segmenter(weight_path=segment_weight_path, save_dir=  self.save_dir)
+        # segment_candidates 大于 0 时分割只为筛选后置信度最高的若干实例解码掩码
+        self.seg_model = Segmenter(weight_path=segment_weight_path, save_dir=  self.save_dir, extract_workers=segment_workers, max_candidates=segment_candidates)
         self.metrics = Metrics(device)
         self.target_height = target_height
         self.target_width = target_width
         self.batch_size = batch_size
+        # 特征提取流水线中预处理好、等待前向的最大批次数
+        self.prefetch_batches = prefetch_batches
         self.topK = topK
-        self.cache_source_img = ""
-        self.det_res = None
-
-    def should_use_cache(self, img):
-        if img == self.cache_source_img:
-            if self.cache_source_img != "":
-                return is_same_img(self.cache_source_img, img)
-            else:
-                return True
-        else:
-            return False
+        # 按截图内容寻址的感知结果缓存，可与 OCR 共享
+        self.perception_cache = perception_cache if perception_cache is not None else PerceptionCache()
+        # 预处理方式变化时特征不再可比，键中带上预处理标识使旧的持久化特征失效
+        model_name = f"{metric_model}_{os.path.basename(metric_weight_path)}_{target_width}x{target_height}"
+        self.embedding_store = EmbeddingStore(embedding_cache_path, model_name)
+        self.icon_keys = {}
+        self.crop_cache = CropEmbeddingCache(max_bytes=int(crop_cache_size_mb * 1024 * 1024))
+        self.segment_imgsz = segment_imgsz
+        # 每个图标最近一次被找到的位置，作为下一次搜索区域的先验；多个设备共用检测器时由调用方按设备传入各自的位置字典
+        self.roi_prior = roi_prior
+        self.roi_padding = roi_padding
+        self.icon_locations = {}
+        # 分层匹配：先做多尺度模板匹配，置信度不足时再走 FastSAM + 特征匹配
+        self.template_match_enabled = template_match
+        self.template_threshold = template_threshold
+        self.template_scales = list(template_scales)
+        self.template_work_scale = template_work_scale
+        self.template_grays = {}
+        # 特征提取前按模板的宽高比、面积、颜色与边缘约束预筛选分割块
+        self.segment_filter = SegmentFilter(**(prefilter_args or {})) if prefilter else None
+        self.template_descriptors = {}
+        # 单个给定最低分数的请求按先验顺序分批提取特征，找到足够可信的匹配后提前结束；
+        # 先验顺序靠前的相似分割块可能先于真正的最佳匹配被接受，因此默认关闭
+        self.ranked_match = ranked_match
+        self.ranked_margin = ranked_margin
+        # 最近一次调用中每个请求的分割块总数、通过数与各约束的拒绝数
+        self.last_filter_stats = []
+        # 每个请求的结果由哪一层产生：template / roi / full / cache
+        self.last_tiers = []
+        self.last_tier = None
+
+    def icon_key(self, icon_img):
+        """
+        计算模板的内容哈希键；本地文件按文件内容计算，并按修改时间缓存，避免重复读取。
+        """
+        if isinstance(icon_img, str) and os.path.isfile(icon_img):
+            mtime = os.path.getmtime(icon_img)
+            cached = self.icon_keys.get(icon_img)
+            if cached is not None and cached[0] == mtime:
+                return cached[1]
+            with open(icon_img, "rb") as f:
+                key = self.embedding_store.key(f.read())
+            self.icon_keys[icon_img] = (mtime, key)
+            return key
+
+        return self.embedding_store.key(load_image_array(icon_img).tobytes())
+
+    @torch.no_grad()
+    def template_embedding(self, icon_img, save=True):
+        """
+        获取模板图标的特征，优先从特征缓存中读取。
+
+        :param icon_img: 模板图片（路径、URL、Base64 或数组）
+        :param save: 新计算的特征是否立即写入特征缓存文件
+        :return: (1, D) 特征张量
+        """
+        key = self.icon_key(icon_img)
+        embedding = self.embedding_store.get(key)
+        if embedding is None:
+            if not (isinstance(icon_img, str) and os.path.isfile(icon_img)):
+                icon_img = load_image(icon_img)
+            embedding = self.metric_model.forward(self.load_img(icon_img)).cpu().numpy()
+            self.embedding_store.put(key, embedding)
+            if save:
+                self.embedding_store.save()
+        return torch.from_numpy(embedding).to(self.device)
+
+    def template_descriptor(self, icon_img):
+        """
+        计算并登记模板的预筛选描述子，已登记的所有模板共同决定哪些分割块需要提取特征。
+
+        :return: 模板描述子，未开启预筛选时返回 None
+        """
+        if self.segment_filter is None:
+            return None
+        key = self.icon_key(icon_img)
+        if key not in self.template_descriptors:
+            img = load_image_array(icon_img)
+            img = cv2.cvtColor(img, cv2.COLOR_GRAY2RGB) if img.ndim == 2 else img[..., :3]
+            self.template_descriptors[key] = self.segment_filter.describe(np.ascontiguousarray(img), masked=False)
+        return self.template_descriptors[key]
+
+    def precompute_templates(self, icon_imgs):
+        """
+        预先计算并缓存一组模板图标的特征（加载任务时调用），新计算的特征最后一次写入特征缓存文件。
+        """
+        for icon_img in icon_imgs:
+            self.template_embedding(icon_img, save=False)
+            self.template_descriptor(icon_img)
+        self.embedding_store.save()
+        print(f"{len(self.embedding_store)} icon embeddings cached")
 
     @torch.no_grad()
-    def det(self, source_img, icon_img):
-        if not self.should_use_cache(source_img):
-            self.cache_source_img = source_img
-            batch_size = self.batch_size
-            topK = self.topK
-            start_time = time.time()
-            input_img = np.array(load_image(source_img))
-            seg_res = self.seg_model.run(source_img, self.device)
-            scores = []
-            temp_list = []
-            temp_bbox_list = []
-            det_res = []
-            img2_t = self.load_img(icon_img)
-            pred2 = self.metric_model.forward(img2_t)
-            for i, (img, bbox) in tqdm(enumerate(seg_res)):
-                img1_t = self.load_img(img)
-                temp_list.append(img1_t)
-                temp_bbox_list.append(bbox)
-                if len(temp_list) % batch_size != 0 and i < len(seg_res) - 1:
+    def warmup(self, screen_shape=(1024, 1024)):
+        """
+        启动时预热：创建常驻的 FastSAM predictor 并对分割模型与 metric model 各做一次前向，
+        使第一次图标查找不再承担模型初始化的开销。
+
+        :param screen_shape: 截图尺寸 (H, W)
+        """
+        start = time.time()
+        self.seg_model.warmup(screen_shape, self.device, self.segment_imgsz)
+        dummy = torch.zeros((1, 3, self.target_height, self.target_width), device=self.device)
+        self.metric_model.forward(dummy)
+        print(f"Icon detector warmed up in {time.time() - start:.2f}s")
+
+    @torch.no_grad()
+    def det(self, source_img, icon_img, region=None, min_score=None, locations=None):
+        """
+        :param source_img: 截图（路径或 Frame）
+        :param icon_img: 模板图标
+        :param region: 搜索区域 [x1, y1, x2, y2]，取值不大于 1 时按截图宽高的比例计算
+        :param min_score: 区域内最高分低于该值时回退到整张截图搜索
+        :param locations: 图标位置先验 {icon_key: bbox}，读取并更新该字典，默认使用 self.icon_locations
+        """
+        det_res = self.det_batch([(source_img, icon_img, region, min_score, locations)])[0]
+        self.last_tier = self.last_tiers[0]
+        return det_res
+
+    @torch.no_grad()
+    def det_batch(self, requests, roi_prior=None):
+        """
+        一次处理多组 (截图, 图标[, 搜索区域, 最低分数]) 请求。
+
+        画面相同的截图上已经处理过的请求直接从感知缓存返回。
+        每个请求先做多尺度模板匹配，置信度同时达到 template_threshold 与 min_score 即直接返回；否则有搜索区域（显式指定或图标上次出现位置的先验）的请求先只在区域内分割和匹配，
+        区域内未找到时与其余请求一起在整张截图上处理。
+
+        :param requests: [(source_img, icon_img[, region, min_score[, locations]]), ...]，locations 见 det
+        :param roi_prior: 是否使用图标上次出现位置作为搜索区域，默认使用 self.roi_prior
+        :return: 每个请求对应的 det_res 列表
+        """
+        roi_prior = self.roi_prior if roi_prior is None else roi_prior
+        requests = [tuple(request) + (None,) * (5 - len(request)) for request in requests]
+        locations = [self.icon_locations if request[4] is None else request[4] for request in requests]
+        # 每个请求的图标上次出现位置
+        priors = [locations[i].get(self.icon_key(request[1])) for i, request in enumerate(requests)]
+        requests = [request[:4] for request in requests]
+        det_res_list = [None] * len(requests)
+        tiers = [None] * len(requests)
+        fingerprints = [self.perception_cache.fingerprint(source_img) for source_img, *_ in requests]
+        queries = [self.query_key(icon_img, region, min_score) for _, icon_img, region, min_score in requests]
+        for i, (source_img, *_) in enumerate(requests):
+            det_res_list[i] = self.perception_cache.get(source_img, "icon", queries[i], fingerprints[i])
+            if det_res_list[i] is not None:
+                tiers[i] = "cache"
+
+        if self.template_match_enabled:
+            for i, (source_img, icon_img, region, min_score) in enumerate(requests):
+                if det_res_list[i] is not None:
                     continue
+                img = load_image_array(source_img)
+                region = self.search_region(img, region) if region is not None else None
+                score, bbox = self.template_match(img, icon_img, region)
+                # 模板匹配的结果同样不能低于调用方要求的最低分数，否则交给区域或整图分割处理
+                if bbox is not None and score >= max(self.template_threshold, min_score or 0):
+                    det_res_list[i] = [(score, bbox)]
+                    tiers[i] = "template"
 
-                pred1  = self.metric_model.forward(torch.concat(temp_list, dim=0))
-                score_list_tmp = self.metrics.cos_metric(pred1, pred2)
-                for j, score in enumerate(score_list_tmp):
-                    score = str(format(score.cpu().numpy(), '.2f'))
-                    # print("\n score is " , float(score))
-                    scores.append(score)
-                    det_res.append((score, temp_bbox_list[j]))
-
-                temp_list.clear()
-                temp_bbox_list.clear()
-
-            print(f"Task finish in {time.time() - start_time} s")
-            # print("max score is: " + max(scores))
-            # print("min score is: " + min(scores))
-            det_res = sorted(det_res, key=lambda x: x[0], reverse=True)
-            top_k = det_res[:topK]
-            for i, (score, bbox) in enumerate(top_k):
-                if i == 0:
-                    color = (255, 0, 0)
+        roi_jobs = []
+        for i, (source_img, icon_img, region, min_score) in enumerate(requests):
+            if det_res_list[i] is not None:
+                continue
+            # 位置先验只在给定最低分数时使用，否则无法判断区域内的结果是否可信
+            use_prior = min_score is not None and roi_prior and priors[i] is not None
+            if region is None and not use_prior:
+                continue
+            img = load_image_array(source_img)
+            region = self.search_region(img, region, priors[i])
+            if region is not None:
+                x1, y1, x2, y2 = region
+                roi_jobs.append((i, Frame(np.ascontiguousarray(img[y1:y2, x1:x2])), region, img.shape[:2]))
+
+        if roi_jobs:
+            # 按截图缩放比例缩小分割输入尺寸，分割耗时随区域面积下降
+            imgsz = max(self.roi_imgsz(crop.image.shape[:2], full_shape) for _, crop, _, full_shape in roi_jobs)
+            roi_res_list = self.det_frames([(crop, requests[i][1], requests[i][3], region[:2], priors[i]) for i, crop, region, _ in roi_jobs], imgsz)
+            for (i, _, region, _), det_res in zip(roi_jobs, roi_res_list):
+                if self.is_accepted(det_res, requests[i][3]):
+                    offset = np.array([region[0], region[1], region[0], region[1]])
+                    det_res_list[i] = [(score, bbox + offset) for score, bbox in det_res]
+                    tiers[i] = "roi"
+                    print(f"Icon found in search region {region}")
                 else:
-                    color = (0, 0, 255)
+                    print(f"Icon not found in search region {region}, fall back to the full screenshot")
 
-                input_img = draw_text(draw_bbox(input_img, bbox, color=color), bbox, str(score), text_color=color)
+        pending = [i for i, det_res in enumerate(det_res_list) if det_res is None]
+        if pending:
+            full_res_list = self.det_frames([(*requests[i][:2], requests[i][3], (0, 0), priors[i]) for i in pending], self.segment_imgsz)
+            for i, det_res in zip(pending, full_res_list):
+                det_res_list[i] = det_res
+                tiers[i] = "full"
 
+        for i, ((source_img, icon_img, _, min_score), det_res) in enumerate(zip(requests, det_res_list)):
+            if self.is_accepted(det_res, min_score):
+                locations[i][self.icon_key(icon_img)] = det_res[0][1]
+            if tiers[i] != "cache":
+                self.perception_cache.put(source_img, "icon", queries[i], det_res, fingerprints[i])
 
-            print("det_res: " , det_res)
-            Image.fromarray(input_img).save(os.path.join(self.save_dir, get_uni_name() + "_pred_result.png"))
+        print(f"Icon detect tiers: {tiers}")
+        self.last_tiers = tiers
+        return det_res_list
 
-            if len(det_res) > 0 and len(det_res) >= topK:
-                self.det_res =  det_res[:topK]
-            else:
-                self.det_res =  det_res
+    @torch.no_grad()
+    def det_many(self, source_img, icon_imgs, region=None, min_score=None, locations=None):
+        """
+        在同一张截图上一次查找多个图标（如 before_check 中的多个 exist_icon、同一页面上连续的 click_icon）。
 
-        else:
-            print("Use cache icon detect result")
+        截图只分割一次、分割块特征只提取一次，所有模板的特征与分割块特征组成一个相似度矩阵，每个模板取各自的最佳分割块；
+        结果写入感知缓存，之后在相同画面上以相同参数查找其中任一图标时直接命中。
+
+        :param icon_imgs: 模板图标列表
+        :param region: 所有图标共用的搜索区域
+        :param min_score: 所有图标共用的最低分数
+        :param locations: 图标位置先验，见 det
+        :return: 每个图标对应的 det_res
+        """
+        # 不按各自的位置先验分别分割区域，所有模板共享整张截图（或共同的搜索区域）上的一次特征提取
+        return self.det_batch([(source_img, icon_img, region, min_score, locations) for icon_img in icon_imgs], roi_prior=False)
+
+    def query_key(self, icon_img, region=None, min_score=None):
+        return self.icon_key(icon_img), tuple(region) if region is not None else None, min_score
+
+    def template_gray(self, icon_img):
+        key = self.icon_key(icon_img)
+        if key not in self.template_grays:
+            self.template_grays[key] = to_gray(load_image_array(icon_img))
+        return self.template_grays[key]
+
+    def template_match(self, img, icon_img, region=None):
+        """
+        在降采样后的灰度图上做多尺度归一化互相关模板匹配。
+
+        :param img: RGB 格式的截图数组
+        :param icon_img: 模板图标
+        :param region: 像素坐标的搜索区域 [x1, y1, x2, y2]
+        :return: (score, bbox)，无法匹配时 bbox 为 None
+        """
+        template = self.template_gray(icon_img)
+        # 纯色模板的互相关没有意义
+        if template.std() < 1:
+            return 0.0, None
+
+        x0, y0 = 0, 0
+        if region is not None:
+            x0, y0, x1, y1 = region
+            img = img[y0:y1, x0:x1]
+        k = self.template_work_scale
+        gray = cv2.resize(to_gray(img), None, fx=k, fy=k, interpolation=cv2.INTER_AREA)
+
+        best_score, best_bbox = 0.0, None
+        for scale in self.template_scales:
+            tw = int(template.shape[1] * scale * k)
+            th = int(template.shape[0] * scale * k)
+            if tw < 8 or th < 8 or tw > gray.shape[1] or th > gray.shape[0]:
+                continue
+            res = cv2.matchTemplate(gray, cv2.resize(template, (tw, th), interpolation=cv2.INTER_AREA), cv2.TM_CCOEFF_NORMED)
+            _, score, _, (x, y) = cv2.minMaxLoc(res)
+            if np.isfinite(score) and score > best_score:
+                best_score = float(score)
+                best_bbox = np.array([x / k + x0, y / k + y0, (x + tw) / k + x0, (y + th) / k + y0]).astype(np.int32)
+
+        return best_score, best_bbox
+
+    @torch.no_grad()
+    def det_frames(self, requests, imgsz=1024):
+        """
+        在整张输入图上处理多组 (截图, 图标) 请求：所有截图的分割合并为一次 FastSAM 批量前向，
+        分割块以流水线方式逐个提取并按 batch_size 分批提取特征。画面相同的截图直接复用感知缓存中的检测框与特征。
+
+        开启预筛选时，只有至少满足一个已登记模板约束的分割块才会提取特征，每个请求只在满足自身模板约束的分割块中排序；
+        缓存的帧缺少当前模板需要的分割块特征时重新分割。
+
+        开启 ranked_match 且只有一个给定最低分数的请求时（如 click_icon）使用排序匹配，见 ranked_match_frame。
+
+        :param requests: [(source_img, icon_img[, min_score[, origin[, prior]]]), ...]，origin 为输入图左上角在整张截图中的坐标，
+            prior 为图标上次出现的位置（整张截图坐标），用于排序匹配
+        """
+        start_time = time.time()
+        requests = [tuple(request) + (None, (0, 0), None)[len(request) - 2:] for request in requests]
+        templates = [self.template_descriptor(icon_img) for _, icon_img, *_ in requests]
+        # 每张截图只计算一次指纹，路径输入不会在查询、写入与分组时反复解码
+        fingerprints = [self.perception_cache.fingerprint(source_img) for source_img, *_ in requests]
+        cached = [self.perception_cache.get(source_img, "seg", imgsz, fingerprint)
+                  for (source_img, *_), fingerprint in zip(requests, fingerprints)]
+        candidates = [None] * len(requests)
+        for i, entry in enumerate(cached):
+            if entry is None:
+                continue
+            _, _, descriptors, embedded = entry
+            if self.segment_filter is not None:
+                candidates[i], _ = self.segment_filter.check(templates[i], descriptors)
+                if (candidates[i] & ~embedded).any():
+                    cached[i] = None
+            elif not embedded.all():
+                cached[i] = None
+        missing = [i for i, res in enumerate(cached) if res is None]
+        if missing and self.ranked_match and len(requests) == 1 and requests[0][2] is not None:
+            cached[0] = self.ranked_match_frame(requests[0], templates[0], imgsz)
+            self.perception_cache.put(requests[0][0], "seg", imgsz, cached[0], fingerprints[0])
+            missing = []
+        if missing:
+            # 同一批请求中画面相同的截图只分割一次
+            frames = {}
+            for i in missing:
+                frames.setdefault(fingerprints[i][0], []).append(i)
+            groups = list(frames.values())
+            boxes = [[] for _ in groups]
+            descriptors = [[] for _ in groups]
+            embedded = [[] for _ in groups]
+            known = list(self.template_descriptors.values())
+
+            def crops():
+                # 分割块只在流水线中短暂存在，缓存中只保留检测框与描述子
+                for k, seg_img, bbox in self.seg_model.stream_batch([requests[group[0]][0] for group in groups], self.device, imgsz=imgsz):
+                    boxes[k].append(bbox)
+                    keep = True
+                    if self.segment_filter is not None:
+                        descriptor = self.segment_filter.describe(seg_img)
+                        descriptors[k].append(descriptor)
+                        keep = bool(self.segment_filter.check_any(known, self.segment_filter.stack([descriptor]))[0])
+                    embedded[k].append(keep)
+                    if keep:
+                        yield seg_img
+
+            features = self.embed(crops())
+            offset = 0
+            for k, group in enumerate(groups):
+                mask = np.array(embedded[k], dtype=bool)
+                n_embedded = int(mask.sum())
+                pred1 = None
+                if n_embedded > 0:
+                    # 未提取特征的分割块对应的行为 0，排序时会被排除
+                    pred1 = features.new_zeros((len(mask), features.shape[1]))
+                    pred1[torch.from_numpy(mask).to(features.device)] = features[offset:offset + n_embedded]
+                offset += n_embedded
+                seg_descriptors = self.segment_filter.stack(descriptors[k]) if self.segment_filter is not None else None
+                entry = (np.array(boxes[k], dtype=np.int32).reshape(-1, 4), pred1, seg_descriptors, mask)
+                for i in group:
+                    cached[i] = entry
+                self.perception_cache.put(requests[group[0]][0], "seg", imgsz, entry, fingerprints[group[0]])
 
-        return self.det_res
+        # 共享同一帧特征的请求一起打分：模板特征堆叠后与分割块特征做一次矩阵乘，得到 分割块 × 模板 的相似度矩阵
+        shared = {}
+        for i, entry in enumerate(cached):
+            shared.setdefault(id(entry), []).append(i)
+        scores = [None] * len(requests)
+        for group in shared.values():
+            pred1 = cached[group[0]][1]
+            if pred1 is None:
+                continue
+            pred2 = torch.concat([self.template_embedding(requests[i][1]) for i in group], dim=0)
+            matrix = self.similarity_matrix(pred1, pred2)
+            for j, i in enumerate(group):
+                scores[i] = matrix[:, j]
 
+        det_res_list = []
+        self.last_filter_stats = []
+        for i, ((source_img, *_), (bboxes, _, descriptors, embedded)) in enumerate(zip(requests, cached)):
+            if self.segment_filter is not None:
+                candidates[i], rejected = self.segment_filter.check(templates[i], descriptors)
+                self.last_filter_stats.append({"segments": len(bboxes), "kept": int(candidates[i].sum()), **rejected})
+                candidates[i] &= embedded
+            elif not embedded.all():
+                candidates[i] = embedded
+            det_res_list.append(self.rank(source_img, bboxes, scores[i], candidates[i]))
 
-    def img_preprocess(self, img):
-        if isinstance(img, str):
-            img_pil = Image.open(img).convert('L')
-        elif isinstance(img, np.ndarray):
-            img_pil = Image.fromarray(img).convert('L')
+        if self.segment_filter is not None:
+            print(f"Segment prefilter: {self.last_filter_stats}")
+        print(f"Task finish in {time.time() - start_time} s")
+        return det_res_list
+
+    def ranked_match_frame(self, request, template, imgsz):
+        """
+        排序匹配：先取得整帧的分割块，按廉价先验（与模板的尺寸相似度、与图标上次位置的距离、颜色直方图距离）排序后
+        按 batch_size 依次提取特征，某一批中的最高分超过最低分数 ranked_margin 以上时停止，剩余的分割块不再提取特征。
+
+        :param request: (source_img, icon_img, min_score, origin, prior)
+        :param template: 模板的预筛选描述子，未开启预筛选时为 None
+        :return: 与 det_frames 缓存条目相同的 (boxes, pred1, descriptors, embedded)，embedded 标记已提取特征的分割块
+        """
+        source_img, icon_img, min_score, origin, prior = request
+        img, result = self.seg_model.segment(source_img, self.device, imgsz=imgsz)
+        # 第一遍只保留检测框与描述子，分割块在提取特征时再按排序重新提取
+        boxes, descriptors = [], []
+        for seg_img, bbox in self.seg_model.extract(img, result):
+            boxes.append(bbox)
+            if self.segment_filter is not None:
+                descriptors.append(self.segment_filter.describe(seg_img))
+        boxes = np.array(boxes, dtype=np.int32).reshape(-1, 4)
+        descriptors = self.segment_filter.stack(descriptors) if self.segment_filter is not None else None
+        embedded = np.zeros(len(boxes), dtype=bool)
+        if len(boxes) == 0:
+            return boxes, None, descriptors, embedded
+
+        order = np.argsort(self.match_prior(icon_img, boxes, descriptors, template, origin, prior), kind="stable")
+        if self.segment_filter is not None:
+            keep, _ = self.segment_filter.check(template, descriptors)
+            order = order[keep[order]]
+
+        pred2 = self.template_embedding(icon_img)
+        batches = 0
+
+        def until(features):
+            nonlocal batches
+            batches += 1
+            return self.metrics.cos_metric(features, pred2).max().item() >= min_score + self.ranked_margin
+
+        crops = (seg_img for seg_img, _ in self.seg_model.extract(img, result, order, save=False))
+        features = self.embed(crops, until=until)
+        pred1 = None
+        if features is not None:
+            indices = order[:len(features)]
+            pred1 = features.new_zeros((len(boxes), features.shape[1]))
+            pred1[torch.from_numpy(indices).to(features.device)] = features
+            embedded[indices] = True
+
+        print(f"Ranked match embedded {int(embedded.sum())}/{len(boxes)} segments in {batches} batches")
+        return boxes, pred1, descriptors, embedded
+
+    def match_prior(self, icon_img, boxes, descriptors=None, template=None, origin=(0, 0), location=None):
+        """
+        分割块的廉价先验代价，越小越先提取特征：宽高比与面积相对模板的对数差、到图标上次出现位置的距离（以图标尺寸为单位）、
+        开启预筛选时再加上颜色直方图距离。
+
+        :param boxes: (N, 4) 的分割块检测框，坐标相对输入图
+        :param origin: 输入图左上角在整张截图中的坐标
+        :param location: 图标上次出现的位置 [x1, y1, x2, y2]，为 None 时不计算距离项
+        :return: (N,) 的代价
+        """
+        th, tw = self.template_gray(icon_img).shape[:2]
+        bw = np.maximum(boxes[:, 2] - boxes[:, 0], 1).astype(np.float64)
+        bh = np.maximum(boxes[:, 3] - boxes[:, 1], 1).astype(np.float64)
+        cost = np.abs(np.log((bw / bh) / (tw / th))) + 0.5 * np.abs(np.log((bw * bh) / (tw * th)))
+
+        if location is not None:
+            x1, y1, x2, y2 = location
+            cx = (boxes[:, 0] + boxes[:, 2]) / 2 + origin[0]
+            cy = (boxes[:, 1] + boxes[:, 3]) / 2 + origin[1]
+            size = max(x2 - x1, y2 - y1, 1)
+            cost += np.hypot(cx - (x1 + x2) / 2, cy - (y1 + y2) / 2) / size
+
+        if descriptors is not None and template is not None and len(descriptors[2]) > 0:
+            cost += 1 - np.minimum(descriptors[2], template[2][None]).sum(axis=1)
+        return cost
+
+    @staticmethod
+    def is_accepted(det_res, min_score):
+        return len(det_res) > 0 and (min_score is None or det_res[0][0] >= min_score)
+
+    def search_region(self, img, region=None, location=None):
+        """
+        计算搜索区域：优先使用显式指定的区域，否则使用图标上次出现位置向外扩展后的区域。
+
+        :param location: 图标上次出现的位置 [x1, y1, x2, y2]
+
+        :return: 像素坐标 [x1, y1, x2, y2]，无需限定区域时返回 None
+        """
+        h, w = img.shape[:2]
+        if region is not None:
+            x1, y1, x2, y2 = region
+            if max(region) <= 1:
+                x1, y1, x2, y2 = x1 * w, y1 * h, x2 * w, y2 * h
+        elif location is not None:
+            x1, y1, x2, y2 = location
+            pad = max(x2 - x1, y2 - y1) * self.roi_padding
+            x1, y1, x2, y2 = x1 - pad, y1 - pad, x2 + pad, y2 + pad
         else:
-            img_pil = img.convert('L')
+            return None
+
+        x1, y1 = max(int(x1), 0), max(int(y1), 0)
+        x2, y2 = min(int(x2), w), min(int(y2), h)
+        if x2 - x1 < 8 or y2 - y1 < 8 or (x2 - x1) * (y2 - y1) >= w * h:
+            return None
+        return [x1, y1, x2, y2]
+
+    def roi_imgsz(self, crop_shape, full_shape):
+        """按区域相对整张截图的比例缩放分割输入尺寸（32 的倍数）"""
+        ratio = max(crop_shape) / max(full_shape)
+        return max(int(np.ceil(self.segment_imgsz * ratio / 32)) * 32, 64)
+
+    @torch.no_grad()
+    def embed(self, imgs, until=None):
+        """
+        按 batch_size 分批提取图像特征，感知哈希命中缓存的分割块不再经过 metric model。
 
-        w,h = img_pil.size
-        if (h != self.target_height or w != self.target_width):
-            img_pil = img_pil.resize((self.target_width, self.target_height))
-            # img_pil = Image.fromarray(cv2.medianBlur(np.array(img_pil), 5))
-            img_pil.save(os.path.join(self.save_dir, get_uni_name() + "_gray.png"))
+        imgs 可以是生成器：后台线程逐个取出图像、查询缓存并预处理下一批输入，同时当前线程在 metric model 上前向当前批次；
+        两者之间的队列最多容纳 prefetch_batches 个批次，因此内存占用与分割块总数无关。
 
-        return img_pil
+        :param imgs: RGB 格式的图像数组列表或生成器
+        :param until: 提前结束的条件，每前向一个批次后以新得到的连续特征 (M, D) 调用，返回 True 时不再从 imgs 中取出图像
+        :return: (N, D) 特征张量，没有图像时返回 None；提前结束时只包含 imgs 前 N 张图像的特征
+        """
+        embeddings = []
+        batches = queue.Queue(maxsize=max(self.prefetch_batches, 1))
+        stop = threading.Event()
+        worker = threading.Thread(target=self._prepare_batches, args=(imgs, embeddings, batches, stop), daemon=True)
+        worker.start()
+        # embeddings 中已经交给 until 检查过的连续前缀长度，提前结束时只保留这一前缀
+        checked, finished = 0, False
+        try:
+            while True:
+                item = batches.get()
+                if item is None:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                indices, keys, batch = item
+                features = self.metric_model.forward(batch).cpu()
+                for i, key, feature in zip(indices, keys, features):
+                    # 复制为独立的张量，避免缓存条目持有整个批次的存储
+                    feature = feature.clone()
+                    embeddings[i] = feature
+                    self.crop_cache.put(key, feature)
+                if until is not None:
+                    end = checked
+                    while end < len(embeddings) and embeddings[end] is not None:
+                        end += 1
+                    if end > checked:
+                        finished = until(torch.stack(embeddings[checked:end], dim=0).to(self.device))
+                        checked = end
+                        if finished:
+                            break
+        finally:
+            stop.set()
+            # 提前退出时取走队列中剩余的批次，使阻塞在 put 上的后台线程能够结束
+            while worker.is_alive():
+                try:
+                    batches.get(timeout=0.1)
+                except queue.Empty:
+                    pass
+
+        if finished:
+            del embeddings[checked:]
+        print(f"Crop embedding cache: {self.crop_cache.stats()}")
+        if len(embeddings) == 0:
+            return None
+        return torch.stack(embeddings, dim=0).to(self.device)
+
+    def _prepare_batches(self, imgs, embeddings, batches, stop):
+        """
+        embed 的后台线程：按顺序为每张图像在 embeddings 中占位，命中缓存的直接填入特征，
+        其余按 batch_size 拼成输入张量放入 batches 队列，结束时放入 None。
+        """
+        try:
+            indices, keys, batch = [], [], []
+            for img in imgs:
+                if stop.is_set():
+                    return
+                key = self.crop_cache.key(img)
+                embeddings.append(self.crop_cache.get(key))
+                if embeddings[-1] is not None:
+                    continue
+                indices.append(len(embeddings) - 1)
+                keys.append(key)
+                batch.append(img)
+                if len(indices) == self.batch_size:
+                    batches.put((indices, keys, self.preprocess_batch(batch)))
+                    indices, keys, batch = [], [], []
+            if indices:
+                batches.put((indices, keys, self.preprocess_batch(batch)))
+        except Exception as e:
+            batches.put(e)
+        finally:
+            batches.put(None)
+
+    @staticmethod
+    def similarity_matrix(pred1, pred2):
+        """
+        :param pred1: (N, D) 分割块特征
+        :param pred2: (T, D) 模板特征
+        :return: (N, T) 余弦相似度矩阵
+        """
+        return F.normalize(pred1, dim=1, eps=1e-8) @ F.normalize(pred2, dim=1, eps=1e-8).T
+
+    def rank(self, source_img, bboxes, scores, candidates=None):
+        """
+        按与模板的余弦相似度取前 topK 个分割块。所有分割块的得分在一个张量中，只做一次 topk 和一次设备到主机的拷贝，
+        得分只在保存结果图和打印日志时才格式化为字符串。
+
+        :param bboxes: (N, 4) 的分割块检测框
+        :param scores: (N,) 的相似度张量，没有分割块特征时为 None
+        :param candidates: (N,) 布尔数组，只在为 True 的分割块中排序，为 None 时使用全部分割块
+        :return: [(score, bbox), ...]，score 为按降序排列的 float，bbox 为 int32 数组
+        """
+        det_res = []
+        if scores is not None:
+            k = scores.numel()
+            if candidates is not None:
+                scores = scores.masked_fill(~torch.from_numpy(candidates).to(scores.device), float("-inf"))
+                k = int(candidates.sum())
+            values, indices = torch.topk(scores, min(self.topK, k))
+            det_res = [(score, bboxes[j]) for score, j in zip(values.tolist(), indices.tolist())]
+
+        if artifact_writer.enabled("summary"):
+            input_img = load_image_array(source_img).copy()
+            for i, (score, bbox) in enumerate(det_res):
+                if i == 0:
+                    color = (255, 0, 0)
+                else:
+                    color = (0, 0, 255)
+
+                input_img = draw_text(draw_bbox(input_img, bbox, color=color), bbox, format(score, '.2f'), text_color=color)
+            artifact_writer.save_image(input_img, os.path.join(self.save_dir, get_uni_name() + "_pred_result.png"))
+
+        print(f"Top {len(det_res)} of {len(bboxes)} segments: {[format(score, '.2f') for score, _ in det_res]}")
+        return det_res
+
+    def gray_img(self, img):
+        """
+        :param img: 图片路径、PIL 图片或 RGB / RGBA / 灰度数组
+        :return: 灰度 PIL 图片
+        """
+        if not isinstance(img, Image.Image):
+            img = Image.fromarray(load_image_array(img))
+        return img.convert('L')
+
+    def preprocess_batch(self, imgs):
+        """
+        批量预处理：所有图像转为灰度后直接缩放进一块预分配的 uint8 缓冲区，整批一次拷贝到设备并归一化到 [-1, 1]，
+        灰度通道通过 expand 扩展为三通道视图而不复制数据。
+
+        灰度转换与缩放（双三次插值）使用 PIL，与 metric model 训练及已缓存的模板特征的预处理逐像素一致；
+        换成 cv2 的插值会改变特征与相似度分数。
+
+        :param imgs: 图片路径、PIL 图片或数组的列表
+        :return: (B, 3, target_height, target_width) 的张量
+        """
+        h, w = self.target_height, self.target_width
+        buffer = np.empty((len(imgs), h, w), dtype=np.uint8)
+        for i, img in enumerate(imgs):
+            gray = self.gray_img(img)
+            if gray.size == (w, h):
+                buffer[i] = np.asarray(gray)
+                continue
+            buffer[i] = np.asarray(gray.resize((w, h), Image.BICUBIC))
+            if artifact_writer.enabled("full"):
+                artifact_writer.save_image(buffer[i].copy(), os.path.join(self.save_dir, get_uni_name() + "_gray.png"), level="full")
+
+        batch = torch.from_numpy(buffer).to(self.device).float().mul_(2 / 255.).sub_(1)
+        return batch.unsqueeze(1).expand(-1, 3, -1, -1)
 
     def load_img(self, path, preprocess = True):
         if preprocess:
-            img_pil = self.img_preprocess(path)
-        else:
-            img_pil = Image.open(path).convert('L')
+            return self.preprocess_batch([path])
 
+        img_pil = Image.open(path).convert('L')
         img_np = np.array(img_pil)
         img_np = np.expand_dims(img_np, axis=-1)
         img_t = self.cv2tensor(img_np, True)
@@ -129,4 +692,4 @@ class IconDetector():
         img_t = torch.unsqueeze(img_t, dim = 0)
         if normalize:
             img_t = img_t * 2 - 1
-        return img_t.to(self.device)
\ No newline at end of file
+        return img_t.to(self.device)
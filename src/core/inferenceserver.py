@@ -0,0 +1,268 @@
+import argparse
+import itertools
+import os
+import queue
+import threading
+import time
+from multiprocessing.connection import Listener, Client
+from src.utils.frame import Frame
+from src.utils.util import load_image_array, load_yaml_file
+from src.utils.artifacts import artifact_writer
+
+
+def to_payload(img):
+    """
+    将图片转换为可以跨进程发送的形式：Frame 只发送像素数组，路径原样发送。
+    """
+    if isinstance(img, Frame):
+        return img.image
+    return img
+
+
+def from_payload(payload):
+    if isinstance(payload, str):
+        return payload
+    return Frame(payload)
+
+
+class InferenceServer:
+    """
+    本地推理服务，独占一份 IconDetector 与 OCR 模型，通过 Unix socket 为多个 Agent 进程提供检测服务。
+
+    每个连接由独立线程接收请求并放入公共队列；主循环从队列中收集请求，最多收集 max_batch 个或等待 max_wait 秒，
+    再按请求类型合并为一次批量前向（IconDetector.det_batch / OCR.det_batch），最后将结果发回各自的连接。
+    图标位置先验由各客户端（RemoteIconDetector）保存并随请求发送，服务端的检测器不在客户端之间共享先验。
+    """
+
+    def __init__(self, icon_detector, text_detector, address, authkey=b"ocr_agent", max_batch=8, max_wait=0.02):
+        """
+        :param icon_detector: IconDetector 实例
+        :param text_detector: OCR 实例
+        :param address: Unix socket 路径
+        :param authkey: 连接认证密钥
+        :param max_batch: 单次批量处理的最大请求数
+        :param max_wait: 收到首个请求后等待更多请求合并的最长时间（秒）
+        """
+        self.icon_detector = icon_detector
+        self.text_detector = text_detector
+        self.address = address
+        self.authkey = authkey
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.requests = queue.Queue()
+        self.running = False
+
+    def serve_forever(self):
+        if os.path.exists(self.address):
+            os.remove(self.address)
+        listener = Listener(self.address, family="AF_UNIX", authkey=self.authkey)
+        self.running = True
+        threading.Thread(target=self._accept_loop, args=(listener,), daemon=True).start()
+        print(f"Inference server listening on {self.address}")
+        try:
+            while self.running:
+                batch = self._collect_batch()
+                if batch:
+                    self._process(batch)
+        finally:
+            listener.close()
+
+    def stop(self):
+        self.running = False
+
+    def _accept_loop(self, listener):
+        while self.running:
+            try:
+                conn = listener.accept()
+            except Exception as e:
+                print(f"Failed to accept inference client: {e}")
+                continue
+            send_lock = threading.Lock()
+            threading.Thread(target=self._receive_loop, args=(conn, send_lock), daemon=True).start()
+
+    def _receive_loop(self, conn, send_lock):
+        while True:
+            try:
+                req_id, kind, payload = conn.recv()
+            except (EOFError, OSError):
+                conn.close()
+                return
+            self.requests.put((conn, send_lock, req_id, kind, payload))
+
+    def _collect_batch(self):
+        try:
+            batch = [self.requests.get(timeout=0.5)]
+        except queue.Empty:
+            return []
+
+        deadline = time.time() + self.max_wait
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.requests.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _process(self, batch):
+        icon_requests = [request for request in batch if request[3] == "icon"]
+        ocr_requests = [request for request in batch if request[3] == "ocr"]
+        many_requests = [request for request in batch if request[3] == "icons"]
+        template_requests = [request for request in batch if request[3] == "templates"]
+        other_requests = [request for request in batch if request[3] not in ("icon", "ocr", "icons", "templates")]
+
+        # 图标请求带有客户端自己的位置先验，检测后连同更新后的先验一起返回，服务端不保存任何客户端的先验
+        if icon_requests:
+            self._run_batch(icon_requests, lambda payloads: list(zip(self.icon_detector.det_batch(
+                [(from_payload(source_img), *args) for source_img, *args in payloads]), [payload[4] for payload in payloads])))
+        if ocr_requests:
+            self._run_batch(ocr_requests, lambda payloads: self.text_detector.det_batch(
+                [from_payload(img) for img in payloads]))
+        for request in many_requests:
+            self._run_batch([request], lambda payloads: [(self.icon_detector.det_many(from_payload(payloads[0][0]), *payloads[0][1:]),
+                                                          payloads[0][4])])
+        for request in template_requests:
+            self._run_batch([request], lambda payloads: [self.icon_detector.precompute_templates(payloads[0])])
+        for request in other_requests:
+            self._reply(request, False, f"UnSupported Request Error: {request[3]}")
+
+    def _run_batch(self, requests, func):
+        print(f"Processing {len(requests)} {requests[0][3]} request(s) in one batch")
+        try:
+            results = func([request[4] for request in requests])
+        except Exception as e:
+            for request in requests:
+                self._reply(request, False, repr(e))
+            return
+
+        for request, result in zip(requests, results):
+            self._reply(request, True, result)
+
+    @staticmethod
+    def _reply(request, status, result):
+        conn, send_lock, req_id = request[:3]
+        try:
+            with send_lock:
+                conn.send((req_id, status, result))
+        except (EOFError, OSError):
+            pass
+
+
+class InferenceClient:
+    """
+    推理服务的客户端连接，同一连接上的请求串行发送。
+    """
+
+    def __init__(self, address, authkey=b"ocr_agent"):
+        self.conn = Client(address, family="AF_UNIX", authkey=authkey)
+        self.lock = threading.Lock()
+        self.req_ids = itertools.count()
+
+    def call(self, kind, payload):
+        with self.lock:
+            req_id = next(self.req_ids)
+            self.conn.send((req_id, kind, payload))
+            while True:
+                res_id, status, result = self.conn.recv()
+                if res_id == req_id:
+                    break
+
+        if not status:
+            raise Exception(f"Inference Server Error: {result}")
+        return result
+
+    def close(self):
+        self.conn.close()
+
+
+class RemoteIconDetector:
+    """
+    与 IconDetector.det 接口一致的远程图标检测器。
+
+    图标位置先验保存在客户端，随每个请求发送并由服务端返回更新后的先验，多个客户端之间互不影响。
+    模板图标在客户端解码后以像素发送，路径不会在服务端按服务端的工作目录解析。
+    """
+
+    def __init__(self, client):
+        self.client = client
+        self.icon_locations = {}
+        # 已解码的本地模板 {绝对路径: (修改时间, 像素数组)}
+        self.templates = {}
+
+    def template_payload(self, icon_img):
+        if not isinstance(icon_img, str):
+            return icon_img
+        if not os.path.isfile(icon_img):
+            return load_image_array(icon_img)
+        path = os.path.abspath(icon_img)
+        mtime = os.path.getmtime(path)
+        cached = self.templates.get(path)
+        if cached is None or cached[0] != mtime:
+            cached = (mtime, load_image_array(path))
+            self.templates[path] = cached
+        return cached[1]
+
+    def det(self, source_img, icon_img, region=None, min_score=None):
+        det_res, self.icon_locations = self.client.call("icon", (to_payload(source_img), self.template_payload(icon_img),
+                                                                 region, min_score, self.icon_locations))
+        return det_res
+
+    def det_many(self, source_img, icon_imgs, region=None, min_score=None):
+        det_res_list, self.icon_locations = self.client.call("icons", (to_payload(source_img),
+                                                                       [self.template_payload(icon_img) for icon_img in icon_imgs],
+                                                                       region, min_score, self.icon_locations))
+        return det_res_list
+
+    def precompute_templates(self, icon_imgs):
+        return self.client.call("templates", [self.template_payload(icon_img) for icon_img in icon_imgs])
+
+
+class RemoteOCR:
+    """
+    与 OCR.det 接口一致的远程文字检测器。
+    """
+
+    def __init__(self, client):
+        self.client = client
+
+    def det(self, img_path):
+        return self.client.call("ocr", to_payload(img_path))
+
+
+def serve(config_path):
+    """
+    根据配置文件加载模型并启动推理服务（阻塞）。
+    """
+    from .icondetector import IconDetector
+    from .textdetector import OCR
+    from .perceptioncache import PerceptionCache
+
+    configs = load_yaml_file(config_path)
+    artifact_writer.configure(**(configs.get("artifacts") or {}))
+    server_configs = configs["inference_server"]
+    perception_cache = PerceptionCache(**(configs.get("perception_cache") or {}))
+    icon_detector = IconDetector(**configs["icon_detector"], perception_cache=perception_cache)
+    if configs.get("warmup", False):
+        icon_detector.warmup()
+    server = InferenceServer(icon_detector, OCR(**configs["text_detector"], perception_cache=perception_cache),
+                             address=server_configs["address"], authkey=server_configs["authkey"].encode(),
+                             max_batch=server_configs.get("max_batch", 8),
+                             max_wait=server_configs.get("max_wait", 0.02))
+    server.serve_forever()
+
+
+def connect(server_configs):
+    """
+    连接推理服务，返回 (RemoteIconDetector, RemoteOCR)。
+    """
+    client = InferenceClient(server_configs["address"], authkey=server_configs["authkey"].encode())
+    return RemoteIconDetector(client), RemoteOCR(client)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Shared inference server for IconDetector and OCR")
+    parser.add_argument("--config", default="configs/config.yaml")
+    args = parser.parse_args()
+    serve(args.config)
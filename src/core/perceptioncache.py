@@ -0,0 +1,114 @@
+import threading
+from collections import OrderedDict
+from src.utils.frame import Frame
+from src.utils.imghash import hamming
+from src.utils.util import image_hash, load_image_array
+
+
+class PerceptionCache:
+    """
+    按截图内容寻址的感知结果缓存，由 IconDetector 与 OCR 共享。
+
+    以截图尺寸与像素内容的摘要作为帧的键，每一帧对应一个条目，条目中按 (类型, 参数) 保存该帧的分割结果、分割块特征、
+    图标检测结果与 OCR 结果。条目数超过 max_frames 时淘汰最久未使用的帧。
+
+    默认 tolerance 为 0，只有像素完全相同（文件名不同但内容相同）的截图才复用结果。tolerance 大于 0 时，
+    内容不同但整张截图差值哈希的汉明距离不超过 tolerance 的帧也视为同一画面，可以让光标闪烁之类细微变化的截图命中缓存；
+    但差值哈希对小面积变化不敏感，改变一个数字、开关状态、角标等变化的距离往往为 0，此时返回的是旧画面的检测结果，
+    因此只在画面变化不影响检测结果的场景下开启。
+    """
+
+    def __init__(self, max_frames=16, tolerance=0, hash_size=32):
+        """
+        :param max_frames: 最多缓存的帧数，为 0 时关闭缓存
+        :param tolerance: 视为同一画面的差值哈希最大汉明距离（位），为 0 时只接受像素完全相同的帧
+        :param hash_size: 帧指纹的差值哈希边长，共 hash_size * hash_size 位
+        """
+        self.max_frames = max_frames
+        self.tolerance = tolerance
+        self.hash_size = hash_size
+        self.lock = threading.Lock()
+        self.frames = OrderedDict()
+        # tolerance 大于 0 时每一帧的差值哈希
+        self.hashes = {}
+        self.hits = 0
+        self.misses = 0
+
+    def fingerprint(self, img):
+        """
+        :param img: 截图（路径或 Frame）
+        :return: ((截图尺寸, 像素内容摘要), 按位打包的差值哈希)，tolerance 为 0 时不计算差值哈希
+        """
+        # 非 Frame 输入先解码一次，Frame 上的摘要与哈希会被缓存
+        frame = img if isinstance(img, Frame) else Frame(load_image_array(img))
+        bits = image_hash(frame, "dhash", self.hash_size) if self.tolerance > 0 else None
+        return (frame.image.shape, frame.digest()), bits
+
+    def _find(self, fingerprint):
+        key, bits = fingerprint
+        if key in self.frames:
+            return key
+        if self.tolerance <= 0 or bits is None:
+            return None
+
+        for other_key in reversed(self.frames):
+            other_bits = self.hashes.get(other_key)
+            if other_key[0] != key[0] or other_bits is None:
+                continue
+            if hamming(bits, other_bits) <= self.tolerance:
+                return other_key
+        return None
+
+    def get(self, img, kind, key=None, fingerprint=None):
+        """
+        查询与 img 画面相同的帧上缓存的结果。
+
+        :param img: 截图（路径或 Frame）
+        :param kind: 结果类型，如 "seg"、"icon"、"ocr"
+        :param key: 结果参数（如分割输入尺寸、图标与搜索区域）
+        :param fingerprint: 预先计算好的帧指纹，避免重复计算
+        :return: 缓存的结果，未命中时返回 None
+        """
+        if self.max_frames <= 0:
+            return None
+        fingerprint = fingerprint if fingerprint is not None else self.fingerprint(img)
+        with self.lock:
+            frame_key = self._find(fingerprint)
+            result = self.frames[frame_key].get((kind, key)) if frame_key is not None else None
+            if result is None:
+                self.misses += 1
+                return None
+            self.frames.move_to_end(frame_key)
+            self.hits += 1
+            return result
+
+    def put(self, img, kind, key, value, fingerprint=None):
+        if self.max_frames <= 0:
+            return
+        fingerprint = fingerprint if fingerprint is not None else self.fingerprint(img)
+        with self.lock:
+            frame_key = self._find(fingerprint)
+            if frame_key is None:
+                frame_key, bits = fingerprint
+                self.frames[frame_key] = {}
+                if bits is not None:
+                    self.hashes[frame_key] = bits
+            self.frames[frame_key][(kind, key)] = value
+            self.frames.move_to_end(frame_key)
+            while len(self.frames) > self.max_frames:
+                old_key, _ = self.frames.popitem(last=False)
+                self.hashes.pop(old_key, None)
+
+    def clear(self):
+        with self.lock:
+            self.frames.clear()
+            self.hashes.clear()
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total > 0 else 0.0,
+            "frames": len(self.frames),
+        }
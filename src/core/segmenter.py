@@ -1,26 +1,169 @@
 from libs.fastsam import FastSAM, FastSAMPrompt
-from src.utils.util import get_uni_name
+from ultralytics.yolo.utils.masks import PackedMasks
+from src.utils.artifacts import artifact_writer
+from src.utils.frame import Frame
+from src.utils.util import get_uni_name, load_image_array
 import numpy as np
+import torch
 from PIL import Image
 import os
 import cv2
-from tqdm import tqdm
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 
 class Segmenter():
-    def __init__(self, weight_path = './weights/FastSAM-s.pt', save_dir = './results'):
+    def __init__(self, weight_path = './weights/FastSAM-s.pt', save_dir = './results', extract_workers = 0, max_candidates = 0, min_box_size = 4, max_box_area = 0.5):
+        """
+        :param max_candidates: 大于 0 时先只做检测框推理，经过廉价筛选后只为置信度最高的 max_candidates 个实例解码掩码
+        :param min_box_size: 候选筛选时检测框的最小边长（像素）
+        :param max_box_area: 候选筛选时检测框面积占整张图的最大比例
+        """
         self.model = FastSAM(weight_path)
         self.save_dir = save_dir
+        # 分割块提取的线程池，为 0 时在当前线程逐个提取
+        self.extract_workers = extract_workers
+        self.extract_pool = ThreadPoolExecutor(max_workers=extract_workers) if extract_workers > 0 else None
+        self.predict_args = dict(retina_masks=True, conf=0.4, iou=0.9, pack_masks=True)
+        self.max_candidates = max_candidates
+        self.min_box_size = min_box_size
+        self.max_box_area = max_box_area
 
-    def run(self, img_path, device = 'cpu'):
-        img = np.array(Image.open(img_path))
-        everything_results = self.model(img_path, device=device, retina_masks=True, imgsz=1024, conf=0.4, iou=0.9, )
-        prompt_process = FastSAMPrompt(img_path, everything_results, device=device)
-        res = prompt_process._format_results(everything_results[0])
-        seg_res = self.extract_all_seg_imgs(res, img, self.save_dir)
-        ann = prompt_process.everything_prompt()
-        prompt_process.plot(annotations=ann, output_path=os.path.join(self.save_dir, get_uni_name() + "_colormap.png") )
+    def warmup(self, shape=(1024, 1024), device = 'cpu', imgsz = 1024):
+        """
+        预先创建 predictor 并在空白图上前向一次，使首次分割不再承担初始化开销。
 
-        return seg_res
+        :param shape: 预期截图尺寸 (H, W)
+        """
+        self.model.warmup(shape, device=device, imgsz=imgsz, **self.predict_args)
+
+    def run(self, img_path, device = 'cpu', imgsz = 1024, select = None):
+        return self.run_batch([img_path], device, imgsz, select)[0]
+
+    def predict(self, img_paths, device = 'cpu', imgsz = 1024, boxes_only = False):
+        # 内存中的帧直接以 BGR 数组送入模型，避免重新读盘解码
+        sources = [img_path.to_bgr() if isinstance(img_path, Frame) else img_path for img_path in img_paths]
+        return self.model(sources if len(sources) > 1 else sources[0], device=device, imgsz=imgsz,
+                          boxes_only=boxes_only, **self.predict_args)
+
+    def detect_boxes(self, img_paths, device = 'cpu', imgsz = 1024):
+        """
+        只做检测框推理，不解码任何掩码，供只需要候选框的调用方使用（如 OCR 候选区域、只需粗略裁剪的图标）。
+
+        :return: 每张截图对应的 (boxes, scores)，boxes 为 (N, 4) int32 的 [x1, y1, x2, y2]
+        """
+        results = self.predict(img_paths, device, imgsz, boxes_only=True)
+        if not results:
+            return [(np.zeros((0, 4), dtype=np.int32), np.zeros(0, dtype=np.float32)) for _ in img_paths]
+        return [(result.boxes.xyxy.cpu().numpy().astype(np.int32), result.boxes.conf.cpu().numpy()) for result in results]
+
+    def select_candidates(self, img, boxes, scores):
+        """
+        廉价的候选筛选：去掉过小的碎片与覆盖大半张图的背景块，再按置信度保留前 max_candidates 个。
+
+        :param img: RGB 格式的截图数组
+        :param boxes: (N, 4) 的检测框
+        :param scores: (N, ) 的置信度
+        :return: 保留的实例下标
+        """
+        h, w = img.shape[:2]
+        bw, bh = boxes[:, 2] - boxes[:, 0], boxes[:, 3] - boxes[:, 1]
+        keep = np.flatnonzero((np.minimum(bw, bh) >= self.min_box_size) & (bw * bh <= self.max_box_area * w * h))
+        keep = keep[np.argsort(-scores[keep], kind="stable")]
+        return keep[:self.max_candidates] if self.max_candidates > 0 else keep
+
+    def run_batch(self, img_paths, device = 'cpu', imgsz = 1024, select = None):
+        """
+        对多张截图做一次批量分割。
+
+        需要筛选候选时（给定 select 或 max_candidates 大于 0）先只推理检测框，筛选后只为保留的实例解码掩码，
+        被丢弃的实例不再经过掩码头的矩阵乘和上采样。
+
+        :param img_paths: 图片路径或 Frame 的列表
+        :param imgsz: 模型输入尺寸
+        :param select: 候选筛选函数 select(img, boxes, scores) -> 保留的实例下标，默认使用 select_candidates
+        :return: 每张截图对应的 [(seg_img, bbox), ...]
+        """
+        seg_results = [[] for _ in img_paths]
+        for k, seg_img, bbox in self.stream_batch(img_paths, device, imgsz, select):
+            seg_results[k].append((seg_img, bbox))
+        return seg_results
+
+    def stream_batch(self, img_paths, device = 'cpu', imgsz = 1024, select = None):
+        """
+        run_batch 的生成器版本：批量分割后逐个提取分割块，每提取出一个就立即产出，调用方无需等待所有分割块。
+
+        :return: 依次产出 (截图下标, seg_img, bbox)
+        """
+        for k, (img, result) in enumerate(self.segment_batch(img_paths, device, imgsz, select)):
+            for seg_img, bbox in self.extract(img, result):
+                yield k, seg_img, bbox
+
+    def segment(self, img_path, device = 'cpu', imgsz = 1024, select = None):
+        return self.segment_batch([img_path], device, imgsz, select)[0]
+
+    def segment_batch(self, img_paths, device = 'cpu', imgsz = 1024, select = None):
+        """
+        批量分割但不提取分割块，配合 extract 按需、按任意顺序提取；掩码以压缩形式保存，占用的内存远小于分割块本身。
+
+        :return: 每张截图对应的 (RGB 截图数组, FastSAM 结果)，没有检测到目标时结果为 None
+        """
+        if select is None and self.max_candidates > 0:
+            select = self.select_candidates
+        imgs = [load_image_array(img_path) for img_path in img_paths]
+        everything_results = self.predict(img_paths, device, imgsz, boxes_only=select is not None)
+        if not everything_results:
+            return [(img, None) for img in imgs]
+
+        segmented = []
+        for img, result in zip(imgs, everything_results):
+            if len(result.boxes) == 0:
+                # 没有检测到任何目标时 masks 为 None，该截图没有分割块
+                segmented.append((img, None))
+                continue
+            if select is not None:
+                keep = select(img, result.boxes.xyxy.cpu().numpy(), result.boxes.conf.cpu().numpy())
+                result = self.model.decode_masks(result, keep)
+            if artifact_writer.enabled("full"):
+                prompt_process = FastSAMPrompt(img, [result], device=device)
+                ann = prompt_process.everything_prompt()
+                artifact_writer.submit(prompt_process.plot, annotations=ann,
+                                       output_path=os.path.join(self.save_dir, get_uni_name() + "_colormap.png"), level="full")
+            segmented.append((img, result))
+        return segmented
+
+    @staticmethod
+    def segment_ids(result):
+        """
+        :return: 掩码非空的实例下标，顺序与 extract 产出分割块的顺序一致
+        """
+        if result is None:
+            return np.zeros(0, dtype=np.int64)
+        masks = result.masks.data
+        if isinstance(masks, PackedMasks):
+            return np.flatnonzero(masks.areas >= 1)
+        return torch.nonzero(masks.flatten(1).sum(1) >= 1).flatten().cpu().numpy()
+
+    @staticmethod
+    def annotation(result, i):
+        """实例 i 的分割结果，压缩掩码只解码到实例所在的窗口"""
+        masks = result.masks.data
+        if isinstance(masks, PackedMasks):
+            return {'id': i, 'bbox': result.boxes.data[i], 'crop': masks.crop(i), 'crop_box': masks.boxes[i]}
+        return {'id': i, 'bbox': result.boxes.data[i], 'segmentation': (masks[i] == 1.0).cpu().numpy()}
+
+    def extract(self, img, result, order = None, save = True):
+        """
+        逐个提取 segment_batch 结果中的分割块，掩码在提取对应的分割块时才解码。
+
+        :param order: 分割块的提取顺序（segment_ids 中的位置），为 None 时按原顺序提取全部分割块
+        :param save: 是否按 full 级别保存分割块
+        :return: 依次产出 (seg_img, bbox)
+        """
+        ids = self.segment_ids(result)
+        if order is not None:
+            ids = ids[np.asarray(order, dtype=np.int64)]
+        items = (self.annotation(result, i) for i in ids)
+        return self.iter_seg_imgs(items, img, self.save_dir if save else None)
 
     def anti_aliasing(self, mask):
         kernel = np.ones((5, 5), np.uint8)
@@ -66,36 +209,71 @@ class Segmenter():
         return result
 
     def extract_all_seg_imgs(self, masks_list, source_img, save_dir):
-        save_dir = os.path.join(save_dir, "segments")
-        os.makedirs(save_dir, exist_ok=True)
+        """
+        按分割结果提取所有分割块。掩码与原图只在每个实例的检测框内裁剪后再做掩码运算和轮廓拟合，
+        耗时与内存随分割块面积而不是屏幕尺寸增长；设置 extract_workers 时使用线程池并行提取。
+
+        :return: [(seg_img, bbox), ...]
+        """
+        return list(self.iter_seg_imgs(masks_list, source_img, save_dir))
+
+    def iter_seg_imgs(self, masks_list, source_img, save_dir):
+        """
+        按顺序逐个产出分割块。使用线程池时同时提交的任务数不超过线程数的两倍，已提取但未被取走的分割块数量有上限。
 
-        seg_imgs = []
+        :param masks_list: 分割结果的列表或迭代器
+        :param save_dir: 分割块的保存目录，为 None 时不保存
+        :return: 依次产出 (seg_img, bbox)
+        """
+        if self.extract_pool is not None:
+            seg_imgs = bounded_map(self.extract_pool, lambda item: self.extract_seg_img(item, source_img), masks_list,
+                                   self.extract_workers * 2)
+        else:
+            seg_imgs = (self.extract_seg_img(item, source_img) for item in masks_list)
 
-        img_copy = source_img.copy()
-        for item in tqdm(masks_list):
-            bbox = item.get("bbox").cpu().numpy()[:4]
-            bbox = bbox.astype(np.int32)
+        for seg_img, bbox in seg_imgs:
+            if save_dir is not None:
+                artifact_writer.save_image(seg_img, os.path.join(save_dir, "segments", get_uni_name() + ".png"), level="full")
+            yield seg_img, bbox
+
+    @staticmethod
+    def extract_seg_img(item, source_img):
+        """
+        在实例检测框内提取单个分割块，并裁剪到最大轮廓的外接矩形。
+        """
+        bbox = item.get("bbox").cpu().numpy()[:4]
+        bbox = bbox.astype(np.int32)
+        if "crop" in item:
+            # 压缩掩码直接给出掩码所在的窗口
+            x1, y1, x2, y2 = item["crop_box"]
+            seg_mask = item["crop"].view(np.uint8)
+        else:
             seg_map = item.get('segmentation')
-            seg_mask = seg_map.astype(np.uint8)
-            seg_mask = np.expand_dims(seg_mask, axis=-1)
-            seg_img = cv2.bitwise_and(source_img, source_img, mask=seg_mask)
-            contours, _ = cv2.findContours(seg_mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-            if contours:
-                largest_contour = max(contours, key=cv2.contourArea)
-                x, y, w, h = cv2.boundingRect(largest_contour)
-                seg_img = seg_img[y:y + h, x:x + w]
-                seg_mask = seg_mask[y:y + h, x:x + w]
-            # b, g, r = cv2.split(seg_img)
-            # alpha_channel = np.ones(b.shape, dtype=b.dtype) * 255
-            # alpha_channel = np.expand_dims(alpha_channel, axis=-1)
-            # alpha_channel[seg_mask == 0] = 0
-            # rgba_image = cv2.merge((b, g, r, alpha_channel))
-            Image.fromarray(seg_img).save(os.path.join(save_dir, get_uni_name() + ".png"))
-            seg_imgs.append((seg_img, bbox))
-            cv2.rectangle(img_copy, (bbox[0], bbox[1]), (bbox[2], bbox[3]), (255, 0, 0), 2)
-            print()
-
-        return seg_imgs
+            h, w = seg_map.shape[:2]
+            # 检测框向外扩展 1 像素，避免取整截掉掩码边缘
+            x1, y1 = max(int(bbox[0]) - 1, 0), max(int(bbox[1]) - 1, 0)
+            x2, y2 = min(int(bbox[2]) + 1, w), min(int(bbox[3]) + 1, h)
+            seg_mask = np.ascontiguousarray(seg_map[y1:y2, x1:x2], dtype=np.uint8)
+        window = source_img[y1:y2, x1:x2]
+        seg_img = cv2.bitwise_and(window, window, mask=seg_mask)
+        contours, _ = cv2.findContours(seg_mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        if contours:
+            largest_contour = max(contours, key=cv2.contourArea)
+            x, y, cw, ch = cv2.boundingRect(largest_contour)
+            seg_img = seg_img[y:y + ch, x:x + cw]
+        return seg_img, bbox
+
+def bounded_map(pool, func, items, max_pending):
+    """
+    与 pool.map 相同按顺序返回结果，但只在取走结果后才提交新的任务，同时进行的任务不超过 max_pending 个。
+    """
+    pending = deque()
+    for item in items:
+        pending.append(pool.submit(func, item))
+        if len(pending) >= max_pending:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
 
 if __name__ == '__main__':
     save_dir = "./seg_results"
@@ -0,0 +1,101 @@
+import cv2
+import numpy as np
+
+# 依次检查的约束，被拒绝的分割块按第一个不满足的约束计数
+REASONS = ("aspect", "area", "colour", "edge")
+
+
+class SegmentFilter:
+    """
+    分割块的廉价预筛选，在特征提取之前去掉不可能与模板匹配的分割块（整行横幅、文本行、几像素宽的碎片等）。
+
+    每张图像（模板或分割块）计算一次描述子：宽高比、面积、粗量化的颜色直方图和边缘密度。
+    模板的描述子给出该模板的约束：宽高比与面积落在模板的容差范围内、颜色直方图交集不低于阈值、边缘密度比例落在容差范围内。
+    所有检查都按分割块向量化计算。
+    """
+
+    def __init__(self, aspect_tolerance=2.0, area_range=(1 / 16, 16), colour_threshold=0.1, edge_tolerance=4.0,
+                 hist_bins=4, size=32):
+        """
+        :param aspect_tolerance: 分割块宽高比与模板宽高比的最大倍数差
+        :param area_range: 分割块面积相对模板面积的 (最小, 最大) 比例
+        :param colour_threshold: 颜色直方图交集的最小值，为 0 时不检查颜色
+        :param edge_tolerance: 边缘密度与模板边缘密度的最大倍数差，为 0 时不检查边缘
+        :param hist_bins: 颜色直方图每个通道的分箱数
+        :param size: 计算颜色与边缘描述子前图像缩放到的边长
+        """
+        self.aspect_tolerance = aspect_tolerance
+        self.area_range = tuple(area_range)
+        self.colour_threshold = colour_threshold
+        self.edge_tolerance = edge_tolerance
+        self.hist_bins = hist_bins
+        self.size = size
+
+    def describe(self, img, masked=True):
+        """
+        :param img: RGB 格式的图像数组
+        :param masked: 图像是否为掩码提取的分割块，是则颜色直方图忽略掩码外的纯黑像素
+        :return: 描述子 (宽高比, 面积, 归一化颜色直方图, 边缘密度)
+        """
+        h, w = img.shape[:2]
+        if h == 0 or w == 0:
+            return 0.0, 0, np.zeros(self.hist_bins ** 3, dtype=np.float32), 0.0
+        small = cv2.resize(img[..., :3], (self.size, self.size), interpolation=cv2.INTER_AREA)
+        gray = cv2.cvtColor(small, cv2.COLOR_RGB2GRAY)
+        mask = (small.max(axis=2) > 0).astype(np.uint8) if masked else None
+        bins = [self.hist_bins] * 3
+        hist = cv2.calcHist([small], [0, 1, 2], mask, bins, [0, 256] * 3).reshape(-1)
+        hist /= max(hist.sum(), 1)
+        edge = np.count_nonzero(cv2.Canny(gray, 100, 200)) / gray.size
+        return w / h, h * w, hist, edge
+
+    @staticmethod
+    def stack(descriptors):
+        """
+        把描述子列表合并为按字段排列的数组 (宽高比 (N,), 面积 (N,), 颜色直方图 (N, B), 边缘密度 (N,))。
+        """
+        if len(descriptors) == 0:
+            return np.zeros(0), np.zeros(0), np.zeros((0, 0), dtype=np.float32), np.zeros(0)
+        aspect, area, hist, edge = zip(*descriptors)
+        return np.array(aspect), np.array(area, dtype=np.float64), np.stack(hist), np.array(edge)
+
+    def check(self, template, segments):
+        """
+        :param template: 模板的描述子
+        :param segments: stack 得到的分割块描述子数组
+        :return: (通过筛选的布尔数组 (N,), 各约束拒绝的分割块数量)
+        """
+        t_aspect, t_area, t_hist, t_edge = template
+        aspect, area, hist, edge = segments
+        n = len(aspect)
+        failed = {}
+        with np.errstate(divide="ignore", invalid="ignore"):
+            ratio = np.abs(np.log(aspect / t_aspect))
+            failed["aspect"] = ~(ratio <= np.log(self.aspect_tolerance))
+            failed["area"] = (area < self.area_range[0] * t_area) | (area > self.area_range[1] * t_area)
+        if self.colour_threshold > 0 and n > 0:
+            failed["colour"] = np.minimum(hist, t_hist[None]).sum(axis=1) < self.colour_threshold
+        else:
+            failed["colour"] = np.zeros(n, dtype=bool)
+        if self.edge_tolerance > 0:
+            # 加上一个小的常数，纯色图像之间的比例仍然有意义
+            ratio = np.abs(np.log((edge + 0.01) / (t_edge + 0.01)))
+            failed["edge"] = ratio > np.log(self.edge_tolerance)
+        else:
+            failed["edge"] = np.zeros(n, dtype=bool)
+
+        keep = np.ones(n, dtype=bool)
+        rejected = {}
+        for reason in REASONS:
+            rejected[reason] = int(np.count_nonzero(keep & failed[reason]))
+            keep &= ~failed[reason]
+        return keep, rejected
+
+    def check_any(self, templates, segments):
+        """
+        :return: 至少通过一个模板约束的布尔数组 (N,)
+        """
+        keep = np.zeros(len(segments[0]), dtype=bool)
+        for template in templates:
+            keep |= self.check(template, segments)[0]
+        return keep
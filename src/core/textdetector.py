@@ -1,7 +1,10 @@
 from paddlex import create_pipeline
 import math
 import os
-from src.utils.util import get_uni_name, is_same_img
+from src.utils.artifacts import artifact_writer
+from src.utils.frame import Frame
+from src.utils.util import get_uni_name
+from .perceptioncache import PerceptionCache
 
 def calculate_bbox_center(bbox):
     min_x, min_y, max_x, max_y = bbox
@@ -72,49 +75,57 @@ def find_bbox_by_text(target_text, bbox_list, text_list, score_list):
         return None,None
 
 class OCR:
-    def __init__(self, save_dir = './results', device = "cpu", text_threshold = 0.85):
+    def __init__(self, save_dir = './results', device = "cpu", text_threshold = 0.85, perception_cache = None):
         self.save_dir = os.path.join(save_dir, get_uni_name())
         self.pipeline = create_pipeline(pipeline="OCR", device=device)
         self.text_threshold = text_threshold
         os.makedirs(self.save_dir, exist_ok=True)
 
-        self.box_list = []
-        self.text_list = []
-        self.score_list = []
-        self.cache_img_path = ""
-
-    def should_use_cache(self, img):
-        if img == self.cache_img_path:
-            if self.cache_img_path != "":
-                return is_same_img(self.cache_img_path, img)
-            else:
-                return True
-        else:
-            return False
-
+        # 按截图内容寻址的感知结果缓存，可与 IconDetector 共享
+        self.perception_cache = perception_cache if perception_cache is not None else PerceptionCache()
 
     def det(self, img_path):
-        if not self.should_use_cache(img_path):
-            self.cache_img_path = img_path
-            output = self.pipeline.predict(img_path)
-            bbox_list = []
-            text_list = []
-            score_list = []
-
-            for res in output:
-                res.save_to_img(self.save_dir)
-                res.save_to_json(self.save_dir)
-                bbox_list += res["dt_polys"]
-                text_list += res["rec_text"]
-                score_list += res["rec_score"]
-
-            bbox_list, text_list, self.score_list = filter_by_score(bbox_list, text_list, score_list, self.text_threshold)
-            self.bbox_list = [bbox_to_corners(bbox) for bbox in bbox_list]
-            self.text_list = [text.strip() for text in text_list]
-        else:
+        return self.det_batch([img_path])[0]
+
+    def det_batch(self, imgs):
+        """
+        一次 pipeline 调用批量识别多张截图。
+
+        :param imgs: 图片路径或 Frame 的列表
+        :return: 每张截图对应的 (bbox_list, text_list, score_list)
+        """
+        fingerprints = [self.perception_cache.fingerprint(img) for img in imgs]
+        results = [self.perception_cache.get(img, "ocr", None, fp) for img, fp in zip(imgs, fingerprints)]
+        missing = [i for i, res in enumerate(results) if res is None]
+        if len(missing) < len(imgs):
             print("Use cache text detect result")
-
-        return self.bbox_list, self.text_list, self.score_list
+        if missing:
+            output = self.pipeline.predict([self.to_source(imgs[i]) for i in missing])
+            for i, res in zip(missing, output):
+                results[i] = self.parse_output([res])
+                self.perception_cache.put(imgs[i], "ocr", None, results[i], fingerprints[i])
+        return results
+
+    def to_source(self, img_path):
+        # 内存中的帧直接以 BGR 数组送入 pipeline
+        return img_path.to_bgr() if isinstance(img_path, Frame) else img_path
+
+    def parse_output(self, output):
+        bbox_list = []
+        text_list = []
+        score_list = []
+
+        for res in output:
+            artifact_writer.submit(res.save_to_img, self.save_dir)
+            artifact_writer.submit(res.save_to_json, self.save_dir)
+            bbox_list += res["dt_polys"]
+            text_list += res["rec_text"]
+            score_list += res["rec_score"]
+
+        bbox_list, text_list, score_list = filter_by_score(bbox_list, text_list, score_list, self.text_threshold)
+        bbox_list = [bbox_to_corners(bbox) for bbox in bbox_list]
+        text_list = [text.strip() for text in text_list]
+        return bbox_list, text_list, score_list
 
 
 
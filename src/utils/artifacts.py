@@ -0,0 +1,167 @@
+import os
+import queue
+import random
+import threading
+import time
+from PIL import Image
+
+LEVELS = {"off": 0, "summary": 1, "full": 2}
+RETENTION_EXTS = (".png", ".jpg", ".jpeg", ".json")
+
+
+class ArtifactWriter:
+    """
+    调试产物（分割块、预处理结果、检测结果图、OCR 结果等）的异步写盘服务。
+
+    按级别控制写盘内容：off 不写任何文件，summary 只保存每一步的检测结果，full 额外保存分割块、预处理图等中间结果。
+    写盘任务放入有界队列由后台线程执行，队列已满时直接丢弃，不阻塞感知流程；full 级别的产物可按 sample_rate 抽样保存。
+    root 目录下的图片与 json 文件总大小超过 max_size_mb 时，从最旧的文件开始删除。
+    """
+
+    def __init__(self, level="summary", root="./results", workers=1, max_queue=64, sample_rate=1.0, max_size_mb=0,
+                 retention_interval=100):
+        """
+        :param level: 写盘级别 off / summary / full
+        :param root: 产物根目录，容量限制只作用于该目录
+        :param workers: 写盘线程数
+        :param max_queue: 等待写盘的最大任务数
+        :param sample_rate: full 级别产物的保存比例
+        :param max_size_mb: root 目录下产物的最大总大小（MB），为 0 时不限制
+        :param retention_interval: 每写入多少个文件检查一次容量
+        """
+        self.threads = []
+        self.queue = None
+        self.settings = None
+        self.configure(level, root, workers, max_queue, sample_rate, max_size_mb, retention_interval)
+
+    def configure(self, level="summary", root="./results", workers=1, max_queue=64, sample_rate=1.0, max_size_mb=0,
+                  retention_interval=100):
+        if level not in LEVELS:
+            raise ValueError(f"Unsupported artifact level: {level}")
+        settings = (level, root, workers, max_queue, sample_rate, max_size_mb, retention_interval)
+        # 多个 Agent 使用相同配置时不重复启动写盘线程
+        if settings == self.settings:
+            return
+        self.settings = settings
+        self.close()
+        self.level = level
+        self.root = root
+        self.sample_rate = sample_rate
+        self.max_bytes = int(max_size_mb * 1024 * 1024)
+        self.retention_interval = retention_interval
+        self.written = 0
+        self.dropped = 0
+        self.lock = threading.Lock()
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.threads = [threading.Thread(target=self._loop, daemon=True) for _ in range(workers if level != "off" else 0)]
+        for thread in self.threads:
+            thread.start()
+
+    def enabled(self, level="summary"):
+        """
+        当前级别是否需要保存 level 级别的产物；调用方应在渲染产物前先判断，避免无用的计算。
+        """
+        return LEVELS[self.level] >= LEVELS[level] > 0
+
+    def submit(self, func, *args, level="summary", **kwargs):
+        """
+        提交一个写盘任务。
+
+        :param func: 在写盘线程中执行的函数
+        :return: 任务是否被接受
+        """
+        if not self.enabled(level):
+            return False
+        if level == "full" and self.sample_rate < 1 and random.random() >= self.sample_rate:
+            return False
+        try:
+            self.queue.put_nowait((func, args, kwargs))
+        except queue.Full:
+            with self.lock:
+                self.dropped += 1
+            return False
+        return True
+
+    def save_image(self, image, path, level="summary"):
+        """
+        :param image: RGB 格式的 numpy 数组或 PIL 图片
+        :param path: 保存路径
+        """
+        return self.submit(_save_image, image, path, level=level)
+
+    def flush(self):
+        """
+        等待队列中所有写盘任务完成。
+        """
+        if self.threads:
+            self.queue.join()
+
+    def close(self):
+        for _ in self.threads:
+            self.queue.put((None, None, None))
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
+
+    def _loop(self):
+        while True:
+            func, args, kwargs = self.queue.get()
+            if func is None:
+                self.queue.task_done()
+                return
+            try:
+                func(*args, **kwargs)
+                with self.lock:
+                    self.written += 1
+                    check_retention = self.max_bytes > 0 and self.written % self.retention_interval == 0
+                if check_retention:
+                    self.enforce_retention()
+            except Exception as e:
+                print(f"Failed to write artifact: {e}")
+            finally:
+                self.queue.task_done()
+
+    def enforce_retention(self):
+        """
+        root 目录下的产物总大小超过限制时，按修改时间从旧到新删除文件。
+        """
+        files = []
+        for dir_path, _, file_names in os.walk(self.root):
+            for file_name in file_names:
+                if file_name.lower().endswith(RETENTION_EXTS):
+                    path = os.path.join(dir_path, file_name)
+                    try:
+                        stat = os.stat(path)
+                    except OSError:
+                        continue
+                    files.append((stat.st_mtime, stat.st_size, path))
+
+        total = sum(size for _, size, _ in files)
+        if total <= self.max_bytes:
+            return
+        start = time.time()
+        removed = 0
+        for _, size, path in sorted(files):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            removed += 1
+        print(f"Artifact retention removed {removed} files in {time.time() - start:.2f}s")
+
+    def stats(self):
+        return {"level": self.level, "queued": self.queue.qsize(), "written": self.written, "dropped": self.dropped}
+
+
+def _save_image(image, path):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    if not isinstance(image, Image.Image):
+        image = Image.fromarray(image)
+    image.save(path)
+
+
+# 进程内共享的写盘服务，启动时通过 artifact_writer.configure(**configs["artifacts"]) 配置
+artifact_writer = ArtifactWriter()
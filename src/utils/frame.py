@@ -0,0 +1,75 @@
+import time
+import uuid
+from datetime import datetime
+import numpy as np
+from PIL import Image
+from src.utils import imghash
+
+
+class Frame:
+    """
+    内存中的屏幕帧。
+
+    image 为 RGB 格式的 numpy 数组 (H, W, 3)；path 只有在帧被持久化到磁盘后才可用，
+    持久化是异步进行的，需要文件时可调用 wait_saved() 等待写盘完成。
+    各种感知哈希在第一次使用时计算并缓存在帧上，同一帧被多处比较时只计算一次。
+    """
+
+    def __init__(self, image, timestamp=None, path=None):
+        """
+        :param image: RGB 格式的 numpy 数组
+        :param timestamp: 截图时间戳，默认为当前时间
+        :param path: 已存在的磁盘文件路径（可选）
+        """
+        self.image = image
+        self.timestamp = timestamp if timestamp is not None else time.time()
+        self.uid = f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4()}"
+        self.path = path
+        self.save_future = None
+        self._bgr = None
+        self.hashes = {}
+
+    @property
+    def width(self):
+        return self.image.shape[1]
+
+    @property
+    def height(self):
+        return self.image.shape[0]
+
+    @property
+    def size(self):
+        return self.width, self.height
+
+    def to_pil(self):
+        return Image.fromarray(self.image)
+
+    def to_bgr(self):
+        """
+        返回 BGR 格式的连续数组（供 OpenCV / ultralytics / paddlex 使用），结果会被缓存。
+        """
+        if self._bgr is None:
+            self._bgr = np.ascontiguousarray(self.image[..., ::-1])
+        return self._bgr
+
+    def _hash(self, key, func, *args):
+        if key not in self.hashes:
+            self.hashes[key] = func(self.image, *args)
+        return self.hashes[key]
+
+    def digest(self):
+        return self._hash("digest", imghash.digest)
+
+    def dhash(self, hash_size=8):
+        return self._hash(("dhash", hash_size), imghash.dhash, hash_size)
+
+    def wait_saved(self):
+        """
+        等待异步写盘完成并返回文件路径；帧未被持久化时返回 None。
+        """
+        if self.save_future is not None:
+            self.save_future.result()
+        return self.path
+
+    def __repr__(self):
+        return f"Frame(uid={self.uid}, size={self.size}, path={self.path})"
@@ -0,0 +1,44 @@
+import hashlib
+import cv2
+import numpy as np
+
+# 0-255 每个字节中 1 的个数，用于按字节查表计算汉明距离
+_POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+def digest(img):
+    """像素内容的摘要，任何一个像素不同结果都不同"""
+    return hashlib.blake2b(np.ascontiguousarray(img).tobytes(), digest_size=16).digest()
+
+
+def to_gray(img):
+    """RGB / 灰度数组转为灰度数组"""
+    if img.ndim == 3:
+        return cv2.cvtColor(img, cv2.COLOR_RGB2GRAY)
+    return img
+
+
+def dhash(img, hash_size=8):
+    """
+    差值哈希：缩小为 (hash_size, hash_size + 1) 的灰度图后比较相邻像素的大小。
+
+    :param img: RGB 或灰度的 numpy 数组
+    :param hash_size: 哈希边长，结果共 hash_size * hash_size 位
+    :return: 按位打包后的 uint8 数组
+    """
+    small = cv2.resize(to_gray(img), (hash_size + 1, hash_size), interpolation=cv2.INTER_AREA)
+    return np.packbits(small[:, 1:] > small[:, :-1])
+
+
+def hamming(hash1, hash2):
+    """
+    两个按位打包的哈希之间的汉明距离；输入为多维数组时沿最后一维计算。
+    """
+    return _POPCOUNT[np.bitwise_xor(hash1, hash2)].sum(axis=-1, dtype=np.int64)
+
+
+def is_similar(hash1, hash2, tolerance=0):
+    """
+    汉明距离不超过 tolerance 时视为相同。
+    """
+    return hash1.shape == hash2.shape and int(hamming(hash1, hash2)) <= tolerance
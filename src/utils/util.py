@@ -1,7 +1,7 @@
 import base64
-import hashlib
 import json
 import os
+from functools import lru_cache
 from io import BytesIO
 import yaml
 import cv2
@@ -11,6 +11,8 @@ import requests
 from PIL import Image, ImageDraw
 from PIL import ImageFont
 import numpy as np
+from src.utils.frame import Frame
+from src.utils import imghash
 
 def get_uni_name():
     now = datetime.now()
@@ -24,6 +26,17 @@ def draw_bbox(img, bbox, color = (0, 0, 255)):
     return img
 
 
+@lru_cache(maxsize=8)
+def load_font(font_path, font_size = 20):
+    """加载并缓存字体，加载失败时返回 None（失败结果同样被缓存，不会重复读盘）"""
+    try:
+        return ImageFont.truetype(font_path, font_size)
+    except Exception as e:
+        print("加载字体文件失败")
+        print(e)
+        return None
+
+
 def draw_text(img, bbox, text, text_color = (0, 0, 255), font_path = "resources/fonts/zhouzisongti.otf"):
     x1, y1 = bbox[0],bbox[1]
     x2, y2 = bbox[2],bbox[3]
@@ -34,28 +47,30 @@ def draw_text(img, bbox, text, text_color = (0, 0, 255), font_path = "resources/
     thickness = 1
     font_scale = 1
 
-    try:
-        font_size = 20
-        font = ImageFont.truetype(font_path, font_size)
-        pil_img = Image.fromarray(cv2.cvtColor(img, cv2.COLOR_BGR2RGB))
-        draw = ImageDraw.Draw(pil_img)
+    font = load_font(font_path, 20)
+    if font is not None:
         # 计算文本的边界框
-        bbox = draw.textbbox((0, 0), text, font=font)
-        text_width = bbox[2] - bbox[0]
-        text_height = bbox[3] - bbox[1]
+        left, top, right, bottom = font.getbbox(text)
+        text_width = right - left
+        text_height = bottom - top
 
         # 计算文本位置
         text_x = x1 + (width - text_width) // 2
         text_y = y1 + (height - text_height) // 2
-        # 绘制文本
-        draw.text((text_x, text_y), text, fill=text_color, font=font)
 
-        # 转换回 OpenCV 格式
-        img = cv2.cvtColor(np.array(pil_img), cv2.COLOR_RGB2BGR)
+        # 只转换文本所在的局部区域，而不是整张图
+        img_h, img_w = img.shape[:2]
+        cx1, cy1 = max(int(text_x + left), 0), max(int(text_y + top), 0)
+        cx2, cy2 = min(int(text_x + right) + 1, img_w), min(int(text_y + bottom) + 1, img_h)
+        if cx2 > cx1 and cy2 > cy1:
+            pil_crop = Image.fromarray(cv2.cvtColor(img[cy1:cy2, cx1:cx2], cv2.COLOR_BGR2RGB))
+            draw = ImageDraw.Draw(pil_crop)
+            # 绘制文本
+            draw.text((text_x - cx1, text_y - cy1), text, fill=text_color, font=font)
+            # 转换回 OpenCV 格式
+            img[cy1:cy2, cx1:cx2] = cv2.cvtColor(np.array(pil_crop), cv2.COLOR_RGB2BGR)
 
-    except Exception as e:
-        print("加载字体文件失败")
-        print(e)
+    else:
         font = cv2.FONT_HERSHEY_SIMPLEX
         (text_width, text_height), baseline = cv2.getTextSize(text, font, font_scale, thickness)
 
@@ -77,8 +92,16 @@ def decode_image(encoded_image, output_path):
 
 
 def load_image(image_input):
+    # 内存中的屏幕帧
+    if isinstance(image_input, Frame):
+        return image_input.to_pil()
+
+    # RGB 格式的 numpy 数组
+    elif isinstance(image_input, np.ndarray):
+        return Image.fromarray(image_input)
+
     # 检查是否是本地文件路径
-    if isinstance(image_input, str) and os.path.isfile(image_input):
+    elif isinstance(image_input, str) and os.path.isfile(image_input):
         return load_image_from_file(image_input)
 
     # 检查是否是有效的 URL
@@ -93,6 +116,15 @@ def load_image(image_input):
         raise ValueError("Unsupported image input format.")
 
 
+def load_image_array(image_input):
+    """加载图像为 RGB 格式的 numpy 数组，内存中的帧不会重复解码"""
+    if isinstance(image_input, Frame):
+        return image_input.image
+    elif isinstance(image_input, np.ndarray):
+        return image_input
+    return np.array(load_image(image_input).convert('RGB'))
+
+
 def load_image_from_file(file_path):
     """从本地文件加载图像"""
     return Image.open(file_path).convert('RGB')
@@ -140,22 +172,28 @@ def load_yaml_file(file_path):
     with open(file_path, 'r') as file:
         return yaml.safe_load(file)
 
-def is_same_img(img1, img2):
-    img1 = load_image(img1)
-    img2 = load_image(img2)
-    def image_hash(image):
-        # 将图像转换为灰度图并缩小
-        img_w, img_h = img1.size
-        image = image.convert('L').resize((img_w // 4, img_h // 4), Image.Resampling.LANCZOS)
-        # 获取像素数据
-        pixels = list(image.getdata())
-        # 计算哈希值
-        return hashlib.md5(bytes(pixels)).hexdigest()
-    hash1 = image_hash(img1)
-    hash2 = image_hash(img2)
-    print("image hash1 ", hash1)
-    print("image hash2 ", hash2)
-    return hash1 == hash2
+def image_hash(image_input, method = "dhash", hash_size = 8):
+    """
+    计算图片的感知哈希，Frame 上的结果会被缓存。
+
+    :param image_input: 图片（路径、URL、Base64、数组或 Frame）
+    :param method: 哈希方法，目前为 "dhash"
+    :return: 按位打包后的 uint8 数组
+    """
+    if isinstance(image_input, Frame):
+        return getattr(image_input, method)(hash_size)
+    return getattr(imghash, method)(load_image_array(image_input), hash_size)
+
+
+def is_same_img(img1, img2, tolerance = 0, hash_size = 32):
+    """
+    根据差值哈希判断两张截图是否为同一画面。
+
+    :param tolerance: 允许的最大汉明距离（位），用于忽略光标闪烁、时钟跳动等细微变化
+    """
+    if img1 is img2:
+        return True
+    return imghash.is_similar(image_hash(img1, "dhash", hash_size), image_hash(img2, "dhash", hash_size), tolerance)
 
 
 def calculate_center(bbox):
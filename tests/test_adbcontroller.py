@@ -0,0 +1,49 @@
+import struct
+import cv2
+import numpy as np
+from src.core.adbcontroller import ADBController, PIXEL_FORMAT_RGBA_8888
+
+
+def make_image():
+    return np.random.default_rng(0).integers(0, 256, (5, 4, 3), dtype=np.uint8)
+
+
+def test_decode_raw_rgba():
+    img = make_image()
+    data = struct.pack("<IIII", 4, 5, PIXEL_FORMAT_RGBA_8888, 0) + np.dstack([img, np.full((5, 4, 1), 255, np.uint8)]).tobytes()
+    assert (ADBController.decode_raw_screencap(data) == img).all()
+
+
+def test_decode_raw_rgb565_falls_back():
+    # RGB_565：每像素 2 字节
+    data = struct.pack("<IIII", 4, 5, 4, 0) + bytes(4 * 5 * 2)
+    assert ADBController.decode_raw_screencap(data) is None
+
+
+def test_decode_png():
+    img = make_image()
+    data = cv2.imencode(".png", img[..., ::-1])[1].tobytes()
+    assert (ADBController.decode_png_screencap(data) == img).all()
+
+
+def test_type_commands_spaces_and_quotes():
+    assert ADBController.build_type_commands("it's a b") == ["input text 'it'\"'\"'s%sa%sb'"]
+
+
+def test_type_commands_literal_percent_s():
+    # "%" 单独输入，避免与后面的 "s" 组成 input text 中表示空格的 "%s"
+    assert ADBController.build_type_commands("50%s") == ["input text 50", "input text %", "input text s"]
+
+
+def test_type_commands_underscore_and_newline():
+    assert ADBController.build_type_commands("a_b\nc\\n\n") == ["input text a_b", "input keyevent 66", "input text c",
+                                                               "input keyevent 66 66"]
+
+
+def test_type_commands_non_ascii():
+    assert ADBController.build_type_commands("hi 抖音") == ["input text hi%s", "am broadcast -a ADB_INPUT_B64 --es msg 5oqW6Z+z"]
+
+
+def test_char_commands_match_bulk_mapping():
+    assert ADBController.build_char_commands("a_ %\n") == ["input text a", "input text _", "input text %s", "input text %",
+                                                          "input keyevent 66"]
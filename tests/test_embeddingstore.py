@@ -0,0 +1,28 @@
+import os
+import numpy as np
+from src.core.embeddingstore import EmbeddingStore
+
+
+def test_truncated_file_starts_empty(tmp_path):
+    path = str(tmp_path / "icons.npz")
+    with open(path, "wb") as f:
+        f.write(b"PK\x03\x04truncated")
+    store = EmbeddingStore(path, "model")
+    assert len(store) == 0
+
+    store.put("a", np.ones((1, 4), dtype=np.float32))
+    store.save()
+    assert len(EmbeddingStore(path, "model")) == 1
+
+
+def test_concurrent_stores_merge(tmp_path):
+    path = str(tmp_path / "icons.npz")
+    first, second = EmbeddingStore(path, "model"), EmbeddingStore(path, "model")
+    first.put("a", np.ones((1, 4), dtype=np.float32))
+    second.put("b", np.zeros((1, 4), dtype=np.float32))
+    first.save()
+    second.save()
+
+    loaded = EmbeddingStore(path, "model")
+    assert loaded.get("a") is not None and loaded.get("b") is not None
+    assert os.listdir(tmp_path) == ["icons.npz"]
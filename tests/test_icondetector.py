@@ -0,0 +1,63 @@
+import numpy as np
+import torch
+
+import src.core.icondetector as icondetector
+from src.core.icondetector import IconDetector
+from src.utils.frame import Frame
+
+
+class PatternModel(torch.nn.Module):
+    """按 4x4 网格的平均灰度作为特征，代替需要权重文件的 metric model"""
+
+    def forward(self, x):
+        return torch.nn.functional.adaptive_avg_pool2d(x[:, :1], 4).flatten(1)
+
+
+class BoxSegmenter:
+    """把固定的检测框作为分割块"""
+
+    def __init__(self, boxes):
+        self.boxes = [np.array(box, dtype=np.int32) for box in boxes]
+
+    def segment(self, img, device='cpu', imgsz=1024, select=None):
+        return img, self.boxes
+
+    def extract(self, img, result, order=None, save=True):
+        image = img.image if isinstance(img, Frame) else img
+        for i in range(len(result)) if order is None else order:
+            x1, y1, x2, y2 = result[i]
+            yield np.ascontiguousarray(image[y1:y2, x1:x2]), result[i]
+
+    def stream_batch(self, img_paths, device='cpu', imgsz=1024, select=None):
+        for k, img in enumerate(img_paths):
+            for seg_img, bbox in self.extract(img, self.boxes):
+                yield k, seg_img, bbox
+
+
+def make_detector(tmp_path, monkeypatch, **kwargs):
+    monkeypatch.setattr(icondetector, "load_pretrained_model", lambda **_: PatternModel())
+    return IconDetector(segment_weight_path='yolov8n-seg.yaml', save_dir=str(tmp_path), target_height=32,
+                        target_width=32, template_match=False, roi_prior=False, **kwargs)
+
+
+def make_screen():
+    rng = np.random.default_rng(0)
+    screen = np.full((400, 400, 3), 128, dtype=np.uint8)
+    icon = rng.integers(0, 256, (64, 64, 3), dtype=np.uint8)
+    # 与图标相似但不同的分割块，位于图标上次出现的位置
+    decoy = icon.copy()
+    decoy[:16] = 128
+    screen[20:84, 20:84] = decoy
+    screen[300:364, 300:364] = icon
+    return screen, icon
+
+
+def test_decoy_earlier_in_prior_order_does_not_win(tmp_path, monkeypatch):
+    screen, icon = make_screen()
+    detector = make_detector(tmp_path, monkeypatch)
+    detector.seg_model = BoxSegmenter([[20, 20, 84, 84], [300, 300, 364, 364]])
+    detector.icon_locations[detector.icon_key(icon)] = np.array([20, 20, 84, 84])
+
+    det_res = detector.det(Frame(screen), icon, min_score=0.5)
+    assert det_res[0][1].tolist() == [300, 300, 364, 364]
+    assert det_res[0][0] > 0.99
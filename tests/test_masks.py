@@ -0,0 +1,47 @@
+import numpy as np
+
+from ultralytics.yolo.utils.masks import PackedMasks
+
+
+def make_masks(n=6, shape=(97, 131), seed=0):
+    rng = np.random.default_rng(seed)
+    masks = np.zeros((n, *shape), dtype=bool)
+    for mask in masks:
+        x1, y1 = rng.integers(0, shape[1] - 20), rng.integers(0, shape[0] - 20)
+        x2, y2 = x1 + rng.integers(5, 40), y1 + rng.integers(5, 40)
+        mask[y1:y2, x1:x2] = rng.random((min(y2, shape[0]) - y1, min(x2, shape[1]) - x1)) > 0.3
+    masks[0] = False  # empty mask
+    return masks
+
+
+def dense_iou(a, b):
+    a, b = a.reshape(len(a), -1).astype(np.int64), b.reshape(len(b), -1).astype(np.int64)
+    inter = a @ b.T
+    union = a.sum(1)[:, None] + b.sum(1)[None] - inter
+    return inter / np.maximum(union, 1)
+
+
+def test_packed_masks_match_dense():
+    masks = make_masks()
+    packed = PackedMasks.from_dense(masks)
+    assert packed.shape == masks.shape
+    assert (packed.to_dense() == masks).all()
+    assert (packed.areas == masks.sum(axis=(1, 2))).all()
+    for i, (x1, y1, x2, y2) in enumerate(packed.boxes):
+        assert (packed.dense(i) == masks[i]).all()
+        assert (packed.crop(i) == masks[i, y1:y2, x1:x2]).all()
+    np.testing.assert_allclose(packed.iou(), dense_iou(masks, masks), rtol=0, atol=1e-6)
+
+    other = make_masks(seed=1)
+    np.testing.assert_allclose(packed.iou(PackedMasks.from_dense(other)), dense_iou(masks, other), rtol=0, atol=1e-6)
+
+
+def test_packed_masks_subset_and_from_crops():
+    masks = make_masks()
+    packed = PackedMasks.from_dense(masks)
+    subset = packed[np.array([4, 1])]
+    assert (subset.to_dense() == masks[[4, 1]]).all()
+
+    crops = [packed.crop(i) for i in range(len(packed))]
+    rebuilt = PackedMasks.from_crops(crops, packed.boxes, masks.shape[1:])
+    assert (rebuilt.to_dense() == masks).all()
@@ -0,0 +1,19 @@
+import numpy as np
+import torch
+
+from ultralytics.yolo.utils import ops
+
+
+def test_crop_first_upsampling_matches_dense():
+    torch.manual_seed(0)
+    shape = (150, 110)
+    protos = torch.randn(32, 40, 40)
+    masks_in = torch.randn(5, 32)
+    bboxes = torch.tensor([[0.0, 0.0, 110.0, 150.0], [10.3, 20.7, 60.2, 90.9], [50.5, 5.5, 51.4, 40.1],
+                           [100.2, 140.6, 110.0, 150.0], [30.0, 30.0, 30.0, 60.0]])
+    dense = ops.process_mask_native(protos, masks_in, bboxes, shape).numpy()
+    crops, windows = ops.process_mask_native_crops(protos, masks_in, bboxes, shape)
+    for mask, crop, (x1, y1, x2, y2) in zip(dense, crops, windows):
+        rebuilt = np.zeros(shape, dtype=bool)
+        rebuilt[y1:y2, x1:x2] = np.asarray(crop, dtype=bool)
+        assert np.count_nonzero(rebuilt != mask.astype(bool)) == 0
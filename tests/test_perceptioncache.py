@@ -0,0 +1,39 @@
+import cv2
+import numpy as np
+from src.core.perceptioncache import PerceptionCache
+from src.utils.frame import Frame
+from src.utils.imghash import dhash, hamming
+
+
+def make_screen(text):
+    img = np.full((1280, 720, 3), 255, dtype=np.uint8)
+    cv2.putText(img, text, (300, 600), cv2.FONT_HERSHEY_SIMPLEX, 1.0, (0, 0, 0), 2)
+    return img
+
+
+def test_one_glyph_change_misses():
+    before, after = make_screen("Coins: 1029"), make_screen("Coins: 1028")
+    # 差值哈希看不到一个数字的变化
+    assert hamming(dhash(before, 32), dhash(after, 32)) == 0
+
+    cache = PerceptionCache()
+    cache.put(Frame(before), "ocr", None, "1029")
+    assert cache.get(Frame(before.copy()), "ocr") == "1029"
+    assert cache.get(Frame(after), "ocr") is None
+
+
+def test_inverted_patch_misses():
+    before = make_screen("Coins: 1029")
+    after = before.copy()
+    after[628:652, 348:372] = 255 - after[628:652, 348:372]
+
+    cache = PerceptionCache()
+    cache.put(Frame(before), "icon", "key", [(0.9, [0, 0, 1, 1])])
+    assert cache.get(Frame(after), "icon", "key") is None
+
+
+def test_tolerance_matches_similar_screens():
+    before, after = make_screen("Coins: 1029"), make_screen("Coins: 1028")
+    cache = PerceptionCache(tolerance=2)
+    cache.put(Frame(before), "ocr", None, "1029")
+    assert cache.get(Frame(after), "ocr") == "1029"
@@ -0,0 +1,34 @@
+import numpy as np
+
+from src.core.segmenter import Segmenter
+from src.utils.frame import Frame
+
+
+def make_segmenter(tmp_path):
+    segmenter = Segmenter(weight_path='yolov8n-seg.yaml', save_dir=str(tmp_path))
+    # 置信度阈值为 1 时任何候选都无法通过 NMS，模拟没有检测到目标的截图
+    segmenter.predict_args['conf'] = 1.0
+    return segmenter
+
+
+def test_stream_batch_without_detections(tmp_path):
+    segmenter = make_segmenter(tmp_path)
+    frame = Frame(np.zeros((320, 320, 3), dtype=np.uint8))
+    assert list(segmenter.stream_batch([frame], imgsz=320)) == []
+    assert list(segmenter.stream_batch([frame, frame], imgsz=320)) == []
+
+
+def test_run_batch_without_detections(tmp_path):
+    segmenter = make_segmenter(tmp_path)
+    frame = Frame(np.zeros((320, 320, 3), dtype=np.uint8))
+    assert segmenter.run_batch([frame, frame], imgsz=320) == [[], []]
+    assert segmenter.run_batch([frame], imgsz=320, select=segmenter.select_candidates) == [[]]
+
+
+def test_detect_boxes_without_detections(tmp_path):
+    segmenter = make_segmenter(tmp_path)
+    frame = Frame(np.zeros((320, 320, 3), dtype=np.uint8))
+    results = segmenter.detect_boxes([frame, frame], imgsz=320)
+    assert len(results) == 2
+    for boxes, scores in results:
+        assert boxes.shape == (0, 4) and scores.shape == (0,)
@@ -0,0 +1,34 @@
+import cv2
+import numpy as np
+
+from src.core.segmentfilter import SegmentFilter
+
+
+def make_templates():
+    circle = np.full((48, 48, 3), 255, dtype=np.uint8)
+    cv2.circle(circle, (24, 24), 18, (220, 40, 40), -1)
+    cv2.putText(circle, "A", (14, 34), cv2.FONT_HERSHEY_SIMPLEX, 0.9, (255, 255, 255), 2)
+    bar = np.full((24, 80, 3), (30, 120, 200), dtype=np.uint8)
+    cv2.rectangle(bar, (4, 4), (75, 19), (250, 250, 250), 2)
+    tile = np.zeros((40, 40, 3), dtype=np.uint8)
+    tile[::8] = (40, 200, 60)
+    tile[:, ::8] = (40, 200, 60)
+    return [circle, bar, tile]
+
+
+def test_templates_pass_as_their_own_segments():
+    segment_filter = SegmentFilter()
+    for template in make_templates():
+        descriptor = segment_filter.describe(template, masked=False)
+        for scale in (1, 2):
+            segment = cv2.resize(template, None, fx=scale, fy=scale, interpolation=cv2.INTER_LINEAR)
+            keep, rejected = segment_filter.check(descriptor, segment_filter.stack([segment_filter.describe(segment)]))
+            assert keep.tolist() == [True], rejected
+
+
+def test_rejects_banner():
+    segment_filter = SegmentFilter()
+    template = segment_filter.describe(make_templates()[0], masked=False)
+    banner = np.full((40, 720, 3), 200, dtype=np.uint8)
+    keep, rejected = segment_filter.check(template, segment_filter.stack([segment_filter.describe(banner)]))
+    assert keep.tolist() == [False] and rejected["aspect"] == 1
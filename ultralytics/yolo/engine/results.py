@@ -14,6 +14,7 @@ import torch
 
 from ultralytics.yolo.data.augment import LetterBox
 from ultralytics.yolo.utils import LOGGER, SimpleClass, deprecation_warn, ops
+from ultralytics.yolo.utils.masks import PackedMasks
 from ultralytics.yolo.utils.plotting import Annotator, colors, save_one_box
 
 
@@ -221,6 +222,8 @@ class Results(SimpleClass):
         pred_probs, show_probs = self.probs, probs
         keypoints = self.keypoints
         if pred_masks and show_masks:
+            if isinstance(pred_masks.data, PackedMasks):
+                pred_masks = Masks(torch.from_numpy(pred_masks.data.to_dense()), pred_masks.orig_shape)
             if img_gpu is None:
                 img = LetterBox(pred_masks.shape[1:])(image=annotator.result())
                 img_gpu = torch.as_tensor(img, dtype=torch.float16, device=pred_masks.data.device).permute(
@@ -449,11 +452,12 @@ class Masks(BaseTensor):
     A class for storing and manipulating detection masks.
 
     Args:
-        masks (torch.Tensor | np.ndarray): A tensor containing the detection masks, with shape (num_masks, height, width).
+        masks (torch.Tensor | np.ndarray | PackedMasks): A tensor containing the detection masks, with shape (num_masks, height, width).
         orig_shape (tuple): Original image size, in the format (height, width).
 
     Attributes:
-        masks (torch.Tensor | np.ndarray): A tensor containing the detection masks, with shape (num_masks, height, width).
+        masks (torch.Tensor | np.ndarray | PackedMasks): A tensor containing the detection masks, with shape (num_masks, height, width).
+                                                        PackedMasks keeps box-cropped bit-packed masks and decodes lazily.
         orig_shape (tuple): Original image size, in the format (height, width).
 
     Properties:
@@ -469,10 +473,29 @@ class Masks(BaseTensor):
 
     def __init__(self, masks, orig_shape) -> None:
         """Initialize the Masks class."""
+        if isinstance(masks, PackedMasks):
+            self.data = masks
+            self.orig_shape = orig_shape
+            return
         if masks.ndim == 2:
             masks = masks[None, :]
         super().__init__(masks, orig_shape)
 
+    @property
+    def packed(self):
+        """Whether the masks are stored as PackedMasks."""
+        return isinstance(self.data, PackedMasks)
+
+    def dense(self):
+        """Return the masks as a dense (num_masks, height, width) tensor or array."""
+        return torch.from_numpy(self.data.to_dense()) if self.packed else self.data
+
+    def __getitem__(self, idx):
+        """Return a Masks object with the specified index, packed masks stay packed."""
+        if self.packed:
+            return self.__class__(self.data[[idx] if isinstance(idx, (int, np.integer)) else idx], self.orig_shape)
+        return super().__getitem__(idx)
+
     @property
     @lru_cache(maxsize=1)
     def segments(self):
@@ -487,7 +510,7 @@ class Masks(BaseTensor):
         """Return segments (normalized)."""
         return [
             ops.scale_coords(self.data.shape[1:], x, self.orig_shape, normalize=True)
-            for x in ops.masks2segments(self.data)]
+            for x in self._segments()]
 
     @property
     @lru_cache(maxsize=1)
@@ -495,7 +518,10 @@ class Masks(BaseTensor):
         """Return segments (pixels)."""
         return [
             ops.scale_coords(self.data.shape[1:], x, self.orig_shape, normalize=False)
-            for x in ops.masks2segments(self.data)]
+            for x in self._segments()]
+
+    def _segments(self):
+        return self.data.segments() if self.packed else ops.masks2segments(self.data)
 
     @property
     def masks(self):
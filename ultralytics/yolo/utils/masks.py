@@ -0,0 +1,209 @@
+# Ultralytics YOLO 🚀, AGPL-3.0 license
+"""
+Compact instance mask container.
+
+Full-resolution masks are mostly empty: each instance only covers its own box. PackedMasks stores every mask as the
+bit-packed window of its box, so N masks cost roughly sum(box areas) / 8 bytes instead of N * H * W. Windows are
+aligned to 8-pixel columns of the full image, which lets area and IoU be computed directly on the packed bytes.
+"""
+
+import cv2
+import numpy as np
+import torch
+
+# number of set bits in every byte value
+_POPCOUNT = np.array([bin(i).count('1') for i in range(256)], dtype=np.int64)
+
+
+class PackedMasks:
+    """
+    Bit-packed, box-cropped binary masks that decode lazily.
+
+    Args:
+        shape (tuple): Full mask size (height, width).
+
+    Attributes:
+        boxes (np.ndarray): (N, 4) int32 windows x1, y1, x2, y2 (exclusive) that contain each mask.
+        areas (np.ndarray): (N, ) int64 number of foreground pixels of each mask.
+        packed (List[np.ndarray]): (y2 - y1, n_bytes) uint8 rows of each window, packed along x.
+        byte_x (np.ndarray): (N, ) int64 first byte column (x // 8) of each packed window.
+    """
+
+    def __init__(self, shape, packed=(), byte_x=(), boxes=None, areas=None):
+        self.mask_shape = tuple(int(s) for s in shape)
+        self.packed = list(packed)
+        self.byte_x = np.asarray(byte_x, dtype=np.int64).reshape(-1)
+        self.boxes = np.asarray(boxes if boxes is not None else np.zeros((0, 4)), dtype=np.int32).reshape(-1, 4)
+        self.areas = np.asarray(areas if areas is not None else
+                                [_POPCOUNT[p].sum() for p in self.packed], dtype=np.int64).reshape(-1)
+
+    @staticmethod
+    def _pack(window, x1):
+        """Pack a boolean window whose left edge is at column x1, aligned to the 8-pixel grid of the image."""
+        left = x1 % 8
+        if left:
+            window = np.pad(window, ((0, 0), (left, 0)))
+        return np.packbits(window, axis=1), x1 // 8
+
+    @classmethod
+    def from_crops(cls, crops, boxes, shape):
+        """
+        Build from per-instance windows.
+
+        Args:
+            crops (List[np.ndarray | torch.Tensor]): Boolean masks of each window.
+            boxes (array-like): (N, 4) windows x1, y1, x2, y2 matching the crop sizes.
+            shape (tuple): Full mask size (height, width).
+        """
+        packed, byte_x = [], []
+        boxes = np.asarray(boxes, dtype=np.int32).reshape(-1, 4)
+        for crop, (x1, y1, x2, y2) in zip(crops, boxes):
+            if isinstance(crop, torch.Tensor):
+                crop = crop.cpu().numpy()
+            p, bx = cls._pack(crop.astype(bool, copy=False), int(x1))
+            packed.append(p)
+            byte_x.append(bx)
+        return cls(shape, packed, byte_x, boxes)
+
+    @classmethod
+    def from_dense(cls, masks):
+        """
+        Build from dense (N, H, W) masks, each mask is cropped to its tight bounding box.
+
+        Args:
+            masks (torch.Tensor | np.ndarray): Binary masks.
+        """
+        if isinstance(masks, torch.Tensor):
+            masks = masks.cpu().numpy()
+        masks = masks.astype(bool, copy=False)
+        n, h, w = masks.shape
+        rows = masks.any(axis=2)  # (N, H)
+        cols = masks.any(axis=1)  # (N, W)
+        empty = ~rows.any(axis=1)
+        y1 = rows.argmax(axis=1)
+        y2 = h - rows[:, ::-1].argmax(axis=1)
+        x1 = cols.argmax(axis=1)
+        x2 = w - cols[:, ::-1].argmax(axis=1)
+        boxes = np.stack([x1, y1, x2, y2], axis=1)
+        boxes[empty] = 0
+        crops = [masks[i, b[1]:b[3], b[0]:b[2]] for i, b in enumerate(boxes)]
+        return cls.from_crops(crops, boxes, (h, w))
+
+    @property
+    def shape(self):
+        """(N, H, W), the shape of the equivalent dense masks."""
+        return (len(self.packed), *self.mask_shape)
+
+    @property
+    def ndim(self):
+        return 3
+
+    @property
+    def nbytes(self):
+        return sum(p.nbytes for p in self.packed)
+
+    def __len__(self):
+        return len(self.packed)
+
+    def crop(self, i):
+        """Decode mask i inside its window, returns a (y2 - y1, x2 - x1) boolean array."""
+        x1, y1, x2, y2 = self.boxes[i]
+        offset = x1 - self.byte_x[i] * 8
+        return np.unpackbits(self.packed[i], axis=1)[:, offset:offset + x2 - x1].astype(bool)
+
+    def dense(self, i):
+        """Decode mask i to a full (H, W) boolean array."""
+        mask = np.zeros(self.mask_shape, dtype=bool)
+        x1, y1, x2, y2 = self.boxes[i]
+        mask[y1:y2, x1:x2] = self.crop(i)
+        return mask
+
+    def to_dense(self):
+        """Decode all masks to a (N, H, W) boolean array."""
+        masks = np.zeros(self.shape, dtype=bool)
+        for i, (x1, y1, x2, y2) in enumerate(self.boxes):
+            masks[i, y1:y2, x1:x2] = self.crop(i)
+        return masks
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self.dense(i)
+
+    def __getitem__(self, idx):
+        """Integer index decodes one dense mask, slices / index arrays / boolean masks return a PackedMasks subset."""
+        if isinstance(idx, (int, np.integer)):
+            return self.dense(idx)
+        if isinstance(idx, torch.Tensor):
+            idx = idx.cpu().numpy()
+        idx = np.arange(len(self))[idx]
+        return PackedMasks(self.mask_shape, [self.packed[i] for i in idx], self.byte_x[idx], self.boxes[idx],
+                           self.areas[idx])
+
+    def cpu(self):
+        return self
+
+    def numpy(self):
+        return self
+
+    def intersections(self, other=None):
+        """
+        Pairwise intersection areas computed on the packed bytes.
+
+        Only pairs whose windows overlap are decoded, and only the overlapping bytes are ANDed.
+
+        Returns:
+            (np.ndarray): (N, M) int64 intersection areas.
+        """
+        other = self if other is None else other
+        a, b = self.boxes.astype(np.int64), other.boxes.astype(np.int64)
+        inter = np.zeros((len(self), len(other)), dtype=np.int64)
+        iy1 = np.maximum(a[:, None, 1], b[None, :, 1])
+        iy2 = np.minimum(a[:, None, 3], b[None, :, 3])
+        ix1 = np.maximum(a[:, None, 0], b[None, :, 0])
+        ix2 = np.minimum(a[:, None, 2], b[None, :, 2])
+        candidates = np.argwhere((iy2 > iy1) & (ix2 > ix1))
+        for i, j in candidates:
+            if other is self and j < i:
+                inter[i, j] = inter[j, i]
+                continue
+            bx1 = max(self.byte_x[i], other.byte_x[j])
+            bx2 = min(self.byte_x[i] + self.packed[i].shape[1], other.byte_x[j] + other.packed[j].shape[1])
+            y1, y2 = iy1[i, j], iy2[i, j]
+            pa = self.packed[i][y1 - a[i, 1]:y2 - a[i, 1], bx1 - self.byte_x[i]:bx2 - self.byte_x[i]]
+            pb = other.packed[j][y1 - b[j, 1]:y2 - b[j, 1], bx1 - other.byte_x[j]:bx2 - other.byte_x[j]]
+            inter[i, j] = _POPCOUNT[pa & pb].sum()
+        return inter
+
+    def iou(self, other=None):
+        """
+        Pairwise mask IoU.
+
+        Args:
+            other (PackedMasks, optional): Masks of the same image size, defaults to self.
+
+        Returns:
+            (np.ndarray): (N, M) float32 IoU matrix.
+        """
+        other = self if other is None else other
+        inter = self.intersections(other)
+        union = self.areas[:, None] + other.areas[None, :] - inter
+        return (inter / np.maximum(union, 1)).astype(np.float32)
+
+    def segments(self, strategy='largest'):
+        """Mask contours in pixels, same output as ops.masks2segments on the dense masks."""
+        segments = []
+        for i, (x1, y1, _, _) in enumerate(self.boxes):
+            c = cv2.findContours(self.crop(i).astype(np.uint8), cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE,
+                                 offset=(int(x1), int(y1)))[0]
+            if c:
+                if strategy == 'concat':  # concatenate all segments
+                    c = np.concatenate([x.reshape(-1, 2) for x in c])
+                elif strategy == 'largest':  # select largest segment
+                    c = np.array(c[np.array([len(x) for x in c]).argmax()]).reshape(-1, 2)
+            else:
+                c = np.zeros((0, 2))  # no segments found
+            segments.append(c.astype('float32'))
+        return segments
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}(n={len(self)}, shape={self.mask_shape}, nbytes={self.nbytes})'
@@ -636,6 +636,60 @@ def process_mask_native(protos, masks_in, bboxes, shape):
     return masks.gt_(0)
 
 
+def _bilinear_taps(out_start, out_end, in_size, out_size, device):
+    """
+    Source indices and weights of output pixels [out_start, out_end) for bilinear resizing with align_corners=False,
+    following the same arithmetic as F.interpolate.
+    """
+    scale = in_size / out_size
+    src = ((torch.arange(out_start, out_end, device=device, dtype=torch.float32) + 0.5) * scale - 0.5).clamp_(min=0)
+    i0 = src.long()
+    i1 = (i0 + 1).clamp_(max=in_size - 1)
+    w1 = src - i0
+    return i0, i1, w1
+
+
+def process_mask_native_crops(protos, masks_in, bboxes, shape):
+    """
+    Crop-first variant of process_mask_native: every mask is upsampled only inside its own bounding box, so the cost
+    scales with the box areas instead of N * H * W. The result is the same as process_mask_native cropped to the boxes.
+
+    Args:
+      protos (torch.Tensor): [mask_dim, mask_h, mask_w]
+      masks_in (torch.Tensor): [n, mask_dim], n is number of masks after nms
+      bboxes (torch.Tensor): [n, 4], n is number of masks after nms, in the coordinates of shape
+      shape (tuple): the size of the input image (h,w)
+
+    Returns:
+      crops (List[torch.Tensor]): n boolean masks of the box windows
+      windows (np.ndarray): [n, 4] int32 windows x1, y1, x2, y2 (exclusive) of the crops in the image
+    """
+    c, mh, mw = protos.shape  # CHW
+    masks = (masks_in @ protos.float().view(c, -1)).view(-1, mh, mw)
+    gain = min(mh / shape[0], mw / shape[1])  # gain  = old / new
+    pad = (mw - shape[1] * gain) / 2, (mh - shape[0] * gain) / 2  # wh padding
+    top, left = int(pad[1]), int(pad[0])  # y, x
+    bottom, right = int(mh - pad[1]), int(mw - pad[0])
+    masks = masks[:, top:bottom, left:right]
+    in_h, in_w = masks.shape[1:]
+
+    # crop_mask keeps pixels with x1 <= x < x2 and y1 <= y < y2
+    windows = bboxes[:, :4].ceil().cpu().numpy().astype(np.int32)
+    windows[:, [0, 2]] = windows[:, [0, 2]].clip(0, shape[1])
+    windows[:, [1, 3]] = windows[:, [1, 3]].clip(0, shape[0])
+    crops = []
+    for mask, (x1, y1, x2, y2) in zip(masks, windows):
+        if x2 <= x1 or y2 <= y1:
+            crops.append(torch.zeros((max(y2 - y1, 0), max(x2 - x1, 0)), dtype=torch.bool, device=masks.device))
+            continue
+        y0, y1_, wy = _bilinear_taps(y1, y2, in_h, shape[0], masks.device)
+        x0, x1_, wx = _bilinear_taps(x1, x2, in_w, shape[1], masks.device)
+        rows = mask[y0] * (1 - wy)[:, None] + mask[y1_] * wy[:, None]  # interpolate along y
+        crop = rows[:, x0] * (1 - wx) + rows[:, x1_] * wx  # interpolate along x
+        crops.append(crop > 0)
+    return crops, windows
+
+
 def scale_coords(img1_shape, coords, img0_shape, ratio_pad=None, normalize=False):
     """
     Rescale segment coordinates (xyxy) from img1_shape to img0_shape